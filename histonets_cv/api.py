@@ -1,70 +1,106 @@
 # -*- coding: utf-8 -*-
 import sys
-import warnings
 from collections import namedtuple
 
 import cv2
 import noteshrink
 import numpy as np
 import PIL
-from imutils import object_detection
 from itertools import combinations
 from simplification.cutil import simplify_coords, simplify_coords_vw
-from skimage import exposure
-from skimage import feature
-from skimage import morphology
-from skimage import filters
-from skimage.util import invert as invert_image
-from sklearn import preprocessing
 
 from .utils import (
+    MatchingImage,
+    PointOperation,
+    TemplateBank,
+    clip_threshold,
     convert,
+    dilate_square,
+    estimate_noise,
+    get_blobs,
+    get_blobs_mask,
+    get_clahe,
     get_color_histogram,
+    get_connectivity,
+    get_gray_histogram,
     get_inner_paths,
     get_palette,
     get_quantize_method,
     get_shortest_paths,
     get_shortest_paths_astar,
+    get_skeleton,
+    get_templates_candidates,
+    get_templates_pairs,
+    guided_filter,
+    hessian_ridges,
+    histogram_thresholds,
     image_as_array,
     kmeans,
-    match_template_mask,
+    map_completed,
+    non_local_means,
     output_as_mask,
+    ridges_downsampling,
     sample_histogram,
+    sauvola_binarize,
+    suppress_matches,
+    to_gray_uint8,
 )
 
 
-@image_as_array
-def adjust_contrast(image, contrast):
+def contrast_operation(contrast):
+    """Return the point operation adjusting the contrast by contrast,
+    ranging from 0 to 200"""
     if (contrast < 0):
         contrast = 0
     elif (contrast > 200):
         contrast = 200
-    contrast = contrast / 100
-    img = image.astype(np.float) * contrast
-    img[img > 255] = 255
-    img[img < 0] = 0
-    return img.astype(np.ubyte)
+    return PointOperation.scale(contrast / 100)
 
 
-@image_as_array
-def adjust_brightness(image, brightness):
+def brightness_operation(brightness):
+    """Return the point operation adjusting the brightness by brightness,
+    ranging from 0 to 200"""
     if (brightness < 0):
         brightness = 0
     elif (brightness > 200):
         brightness = 200
-    brightness = (((brightness) * (510)) / 200) - 255
-    img = image.astype(np.float) + brightness
-    img[img > 255] = 255
-    img[img < 0] = 0
-    return img.astype(np.ubyte)
+    return PointOperation.shift((((brightness) * (510)) / 200) - 255)
+
+
+@image_as_array
+def adjust_point_operations(image, operations):
+    """Fuse a list of point operations into a single lookup table and apply
+    it to image in one pass"""
+    fused = PointOperation()
+    for operation in operations:
+        fused = fused.then(operation)
+    return fused(image)
+
+
+@image_as_array
+def adjust_contrast(image, contrast):
+    return contrast_operation(contrast)(image)
+
+
+@image_as_array
+def adjust_brightness(image, brightness):
+    return brightness_operation(brightness)(image)
 
 
 @image_as_array
-def smooth_image(image, kernel):
+def smooth_image(image, kernel, method='bilateral'):
+    """Smooth image preserving edges using kernel, from 0 to 100, as the
+    diameter of the neighborhood and as the range of colors to mix.
+    Method can be 'bilateral' (default), or 'guided' for a fast approximation
+    whose cost does not depend on the size of the kernel."""
     if (kernel < 0):
         kernel = 0
     elif (kernel > 100):
         kernel = 100
+    if method == 'guided':
+        # radius and regularization empirically set to approximate the
+        # bilateral filter output for the same kernel
+        return guided_filter(image, kernel // 4, (kernel / 4) ** 2)
     return cv2.bilateralFilter(image, kernel, kernel, kernel)
 
 
@@ -75,21 +111,54 @@ def histogram_equalization(image, tile):
     elif (tile > 100):
         tile = 100
     tile = int(tile / 10)
-    img_yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
-    clahe = cv2.createCLAHE(clipLimit=1.0, tileGridSize=(2 ** tile, 2 ** tile))
-    img_yuv[:, :, 0] = clahe.apply(img_yuv[:, :, 0])
-    img_out = cv2.cvtColor(img_yuv, cv2.COLOR_YCrCb2BGR)
-    img = exposure.rescale_intensity(img_out)
+    clahe = get_clahe(2 ** tile)
+    # all the steps run in uint8 and update the same buffer in place
+    img = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
+    luma = cv2.extractChannel(img, 0)
+    clahe.apply(luma, dst=luma)
+    cv2.insertChannel(luma, img, 0)
+    cv2.cvtColor(img, cv2.COLOR_YCrCb2BGR, dst=img)
+    # stretch intensities to the full range
+    low, high, _, _ = cv2.minMaxLoc(img.reshape(-1, 1))
+    if low < high and (low > 0 or high < 255):
+        PointOperation.stretch(low, high)(img, inplace=True)
     return img
 
 
 @image_as_array
-def denoise_image(image, value):
+def denoise_image(image, value, luma=False, auto=False, fast=False,
+                  scale=100):
+    """Denoise image using non-local means with value, from 0 to 100, as the
+    strength of the filter. If auto is True, the strength is estimated from
+    the level of noise of a sample of image instead.
+
+    Faster but lower quality results can be obtained by denoising only the
+    luma channel (luma), by using smaller template and search windows (fast),
+    and by denoising a version of image downscaled to scale percent (from 1
+    to 100) that then guides the filtering of the full resolution image."""
+    if auto:
+        value = estimate_noise(image)
     if (value < 0):
         value = 0
     elif (value > 100):
         value = 100
-    return cv2.fastNlMeansDenoisingColored(image, None, value, value)
+    if scale < 1:
+        scale = 1
+    elif scale > 100:
+        scale = 100
+    windows = (5, 11) if fast else (7, 21)
+    if scale == 100:
+        return non_local_means(image, value, luma, windows)
+    factor = scale / 100
+    small_image = cv2.resize(image, None, fx=factor, fy=factor,
+                             interpolation=cv2.INTER_AREA)
+    # downscaling by area averaging also reduces the noise by factor
+    small_denoised = non_local_means(small_image, value * factor, luma,
+                                     windows)
+    guide = cv2.resize(small_denoised, image.shape[1::-1],
+                       interpolation=cv2.INTER_LINEAR)
+    return guided_filter(image, int(round(1 / factor)), (value / 4) ** 2,
+                         guide=guide)
 
 
 @image_as_array
@@ -175,55 +244,141 @@ def auto_clean(image, background_value=25, background_saturation=20,
 
 
 @image_as_array
-def match_templates(image, templates, overlap=0.15):
+def match_templates(image, templates, overlap=0.15, workers=1,
+                    engine='opencv', pyramid=0, suppression='template',
+                    peaks=False, max_matches=None, regions=None,
+                    tile_size=None, return_scores=False):
     """Look for templates in image and return the matches.
 
     Each entry in the templates list is a dictionary with keys 'image',
     'threshold', 'flip', 'mask' and its matching
-    'method' (None, 'laplacian', 'canny')."""
-    default_threshold = 80
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    rectangles = np.empty([0, 2, 2], dtype=int)
-    for template in templates:
-        threshold = template.get('threshold', default_threshold)
-        if threshold > 100:
-            threshold = 100
-        elif threshold < 0:
-            threshold = 0
-        threshold /= 100.0
-        template_image = template.get('image')
-        template_flip = template.get('flip')
-        template_mask = template.get('mask')
-        template_method = template.get('method', 'canny')  # defaults to canny
-        gray_template = cv2.cvtColor(template_image, cv2.COLOR_BGR2GRAY)
-        transformations = [lambda im: im]
-        if template_flip:
-            if template_flip[0] in ('h', 'a'):
-                transformations.append(lambda im: cv2.flip(im, 1))
-            if template_flip[0] in ('v', 'a'):
-                transformations.append(lambda im: cv2.flip(im, 0))
-            if template_flip[0] in ('b', 'a'):
-                transformations.append(lambda im: cv2.flip(cv2.flip(im, 1), 0))
-        for transformation in transformations:
-            transformed_template = transformation(gray_template)
-            height, width = transformed_template.shape
-            if template_mask is not None:
-                transformed_mask = transformation(template_mask)
-            else:
-                transformed_mask = None
-            results = match_template_mask(gray_image, transformed_template,
-                                          transformed_mask, template_method)
-            index = results >= threshold
-            y1, x1 = np.where(index)
-            y2, x2 = y1 + height, x1 + width
-            coords = np.array([x1, y1, x2, y2], dtype=int).T
-            probs = results[index]
-            boxes = np.array(
-                object_detection.non_max_suppression(coords, probs, overlap)
-            )
-            xyboxes = boxes.reshape(boxes.shape[0], 2, 2)  # list of x,y points
-            rectangles = np.vstack([rectangles, xyboxes])
-    return rectangles.astype(int)
+    'method' (None, 'laplacian', 'canny', 'chamfer', 'orb').
+    The 'chamfer' method scores locations by the distances from the edges
+    of the templates to the closest edges of image, which is more tolerant
+    with thin line-art symbols (ref: utils.match_template_chamfer()).
+    The 'orb' method matches ORB keypoints of the templates and of image
+    instead of correlating every location, so templates are also found
+    rotated or rescaled (ref: utils.get_keypoints_candidates()).
+    Templates can also be a utils.TemplateBank, with the templates already
+    prepared and their features precomputed, possibly loaded from disk.
+
+    Image can also be a MatchingImage, so its edge maps are computed only
+    once and shared by all the templates and across calls.
+
+    Every template and flip is matched independently, so they can be spread
+    over a pool of workers threads. Overlapping matches are then suppressed
+    in one single pass over all the candidates, either only among matches
+    of the same template and its flips ('template', default), or among all
+    of them ('global'), keeping the best scoring ones. Matches are always
+    returned in the order of the templates, and by decreasing score, with
+    the matches of all the flips of a template merged.
+    If return_scores is True, the score and the index in templates of each
+    match are returned as well.
+
+    To keep the number of candidates to suppress small, only the locations
+    that are local maxima of the scores can be considered (peaks), and only
+    the max_matches best scoring local maxima of every template and flip
+    are kept, returning at most max_matches matches per template.
+
+    The 'opencv' engine correlates every template with cv2.matchTemplate.
+    The 'fft' engine correlates templates without mask, or with mask and
+    None as method, in the frequency domain instead, sharing the spectra
+    and the window norms of image across all of them, which pays off when
+    many templates (or flips) have the same size.
+
+    If pyramid is greater than 0, templates are matched coarse-to-fine,
+    first against image downscaled pyramid times by a factor of 2, and then
+    only around the candidate locations at full resolution (ref:
+    utils.match_template_pyramid()).
+
+    If regions is given, as a list of polygons expressed as lists of [x, y]
+    points, or of rectangles expressed as their [[x1, y1], [x2, y2]]
+    corners, only the matches centered inside them are looked for, and
+    correlation runs only on crops around them (ref:
+    utils.get_regions_candidates()).
+
+    If tile_size is given, image (or every region) is matched tile by tile,
+    every tile of up to tile_size by tile_size pixels overlapping its
+    neighbours by the size of the largest template, so score maps take
+    memory proportional to the tiles and not to image. Candidates of all
+    tiles are merged before suppression."""
+    # page-side features are computed once for all templates and flips
+    if isinstance(image, MatchingImage):
+        matching_image = image
+    else:
+        matching_image = MatchingImage(image)
+    coords, probs, indices = get_templates_candidates(
+        matching_image, get_templates_pairs(templates), workers, engine,
+        pyramid, peaks, max_matches, regions, tile_size)
+    keep = suppress_matches(coords, probs, indices, overlap, suppression,
+                            max_matches)
+    rectangles = coords[keep].reshape(-1, 2, 2)  # list of x,y points
+    if return_scores:
+        return rectangles, probs[keep], indices[keep]
+    return rectangles
+
+
+@image_as_array
+def match_templates_thresholds(image, templates, thresholds, overlap=0.15,
+                               workers=1, engine='opencv', pyramid=0,
+                               suppression='template', peaks=False,
+                               max_matches=None, regions=None,
+                               tile_size=None, return_scores=False):
+    """Look for templates in image as match_templates() does, but for each
+    of the thresholds, from 0 to 100, instead of the threshold of every
+    template. Scores are computed only once for the lowest threshold, and
+    then suppression is run for each threshold.
+    Returns a list with the matches, or the matches, their scores and
+    template indices if return_scores is True, in the same order as
+    thresholds."""
+    if isinstance(image, MatchingImage):
+        matching_image = image
+    else:
+        matching_image = MatchingImage(image)
+    thresholds = [clip_threshold(threshold) for threshold in thresholds]
+    pairs = get_templates_pairs(templates, min(thresholds, default=1.0))
+    coords, probs, indices = get_templates_candidates(
+        matching_image, pairs, workers, engine, pyramid, peaks, max_matches,
+        regions, tile_size)
+    outputs = []
+    for threshold in thresholds:
+        selected = np.flatnonzero(probs >= threshold)
+        keep = selected[suppress_matches(
+            coords[selected], probs[selected], indices[selected], overlap,
+            suppression, max_matches)]
+        rectangles = coords[keep].reshape(-1, 2, 2)  # list of x,y points
+        if return_scores:
+            outputs.append((rectangles, probs[keep], indices[keep]))
+        else:
+            outputs.append(rectangles)
+    return outputs
+
+
+def match_templates_batch(images, templates, overlap=0.15, workers=1,
+                          batch_workers=1, engine='opencv', pyramid=0,
+                          suppression='template', peaks=False,
+                          max_matches=None, regions=None, tile_size=None,
+                          return_scores=False):
+    """Look for templates in every image of images as match_templates()
+    does, preparing templates only once as a utils.TemplateBank, unless
+    they already are one, shared by all the images.
+
+    Images are matched by a pool of batch_workers threads, each one using
+    workers threads for the templates, and they are only taken from images
+    when a thread is about to be free, so images can be a generator that
+    loads them one at a time.
+    Yields the position of every image in images and its matches, or its
+    matches, their scores and template indices if return_scores is True,
+    as soon as each image is done, which may not be in order."""
+    if not isinstance(templates, TemplateBank):
+        templates = TemplateBank(templates, pyramid)
+    options = dict(overlap=overlap, workers=workers, engine=engine,
+                   pyramid=pyramid, suppression=suppression, peaks=peaks,
+                   max_matches=max_matches, regions=regions,
+                   tile_size=tile_size, return_scores=return_scores)
+    yield from map_completed(
+        lambda image: match_templates(image, templates, **options), images,
+        batch_workers)
 
 
 @image_as_array
@@ -266,25 +421,17 @@ def select_colors(image, colors, return_mask=False):
 @image_as_array
 @output_as_mask
 def remove_ridges(image, width=6, threshold=160, dilation=1,
-                  return_mask=False):
+                  downsample=False, return_mask=False):
     """Detect ridges of width pixels using the highest eigenvector of the
     Hessian matrix, then create a binarized mask with threshold and remove
     it from image (set to black). Default values are optimized for text
-    detection and removal.
+    detection and removal. Width can also be a list of widths to detect
+    in one pass, and ridges can be detected on a downsampled image
+    (ref: detect_ridges()).
 
     A dilation radius in pixels can be passed in to thicken the mask prior
     to being applied."""
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    # The value of sigma is calculated according to Steger's work:
-    # An Unbiased Detector of Curvilinear Structures,
-    # IEEE Transactions on Pattern Analysis and Machine Intelligence,
-    # Vol. 20, No. 2, Feb 1998
-    # http://ieeexplore.ieee.org/document/659930/
-    sigma = (width / 2) / np.sqrt(3)
-    hxx, hxy, hyy = feature.hessian_matrix(gray_image, sigma=sigma, order='xy')
-    large_eigenvalues, _ = feature.hessian_matrix_eigvals(hxx, hxy, hyy)
-    mask = convert(large_eigenvalues)
-    mask = binarize_image(mask, method='boolean', threshold=threshold)
+    mask = detect_ridges(image, width, threshold, downsample)
     if dilation:
         dilation = (2 * dilation) + 1
         dilation_kernel = np.ones((dilation, dilation), np.uint8)
@@ -292,14 +439,84 @@ def remove_ridges(image, width=6, threshold=160, dilation=1,
     return image, 255 - mask
 
 
+@image_as_array
+def detect_ridges(image, width=6, threshold=160, downsample=False,
+                  return_widths=False):
+    """Detect ridges of width pixels, or of any of the widths in a list,
+    using the highest eigenvector of the Hessian matrix, and return a mask
+    with the ridges in white, binarized using threshold.
+    If downsample is True, wide ridges are detected on a downsampled copy of
+    image whose factor is tied to the scale of the ridges, and the mask is
+    upsampled afterwards, which is much faster for wide ridges.
+    If return_widths is True, an image with the width whose scale normalized
+    response is the strongest for each ridge pixel (0 elsewhere) is returned
+    as well."""
+    gray_image = to_gray_uint8(image)
+    size = gray_image.shape[::-1]
+    widths = [width] if np.isscalar(width) else list(width)
+    mask = np.zeros(gray_image.shape, dtype=np.uint8)
+    if return_widths:
+        best_widths = np.zeros(mask.shape, dtype=np.min_scalar_type(
+            max(widths)))
+        best_responses = np.full(mask.shape, -np.inf, dtype=np.float32)
+    for ridge_width in widths:
+        # The value of sigma is calculated according to Steger's work:
+        # An Unbiased Detector of Curvilinear Structures,
+        # IEEE Transactions on Pattern Analysis and Machine Intelligence,
+        # Vol. 20, No. 2, Feb 1998
+        # http://ieeexplore.ieee.org/document/659930/
+        sigma = (ridge_width / 2) / np.sqrt(3)
+        factor = ridges_downsampling(sigma) if downsample else 1
+        if factor > 1:
+            coarse_image = cv2.resize(gray_image, None, fx=1 / factor,
+                                      fy=1 / factor,
+                                      interpolation=cv2.INTER_AREA)
+        else:
+            coarse_image = gray_image
+        sigma /= factor
+        eigenvalues = hessian_ridges(coarse_image, sigma)
+        if return_widths:
+            # scale normalized responses are comparable across widths
+            responses = eigenvalues * sigma ** 2
+            if factor > 1:
+                responses = cv2.resize(responses, size,
+                                       interpolation=cv2.INTER_LINEAR)
+        width_mask = binarize_image(convert(eigenvalues), method='boolean',
+                                    threshold=threshold)
+        if factor > 1:
+            width_mask = cv2.resize(width_mask, size,
+                                    interpolation=cv2.INTER_LINEAR)
+            cv2.threshold(width_mask, 127, 255, cv2.THRESH_BINARY,
+                          dst=width_mask)
+        if len(widths) == 1 and not return_widths:
+            return width_mask
+        cv2.bitwise_or(mask, width_mask, dst=mask)
+        if return_widths:
+            stronger = (width_mask > 0) & (responses > best_responses)
+            best_responses[stronger] = responses[stronger]
+            best_widths[stronger] = ridge_width
+    if return_widths:
+        return mask, best_widths
+    return mask
+
+
 @image_as_array
 @output_as_mask
 def remove_blobs(image, min_area=0, max_area=sys.maxsize, threshold=128,
-                 method='8-connected', return_mask=False):
+                 method='8-connected', engine='contours', return_mask=False):
     """Binarize image using threshold, and remove (turn into black)
     blobs of connected pixels of white of size bigger or equal than
     min_area but smaller or equal than max_area from the original image,
-    returning it afterward."""
+    returning it afterward.
+    The 'contours' engine measures blobs by the area of their contour polygon
+    and redraws them using method as the line type. The 'components' engine
+    labels connected components instead and measures blobs by their number of
+    pixels, using 4 or 8 connectivity ('16-connected' and 'antialiased'
+    behave as '8-connected')."""
+    mono_image = binarize_image(image, method='boolean', threshold=threshold)
+    if engine == 'components':
+        blobs = get_blobs(mono_image, get_connectivity(method))
+        return image, get_blobs_mask(blobs, min_area, max_area)
     method = method.lower()
     if method == '4-connected':
         method = cv2.LINE_4
@@ -307,7 +524,6 @@ def remove_blobs(image, min_area=0, max_area=sys.maxsize, threshold=128,
         method = cv2.LINE_AA
     else:  # 8-connected
         method = cv2.LINE_8
-    mono_image = binarize_image(image, method='boolean', threshold=threshold)
     _, all_contours, _ = cv2.findContours(mono_image, cv2.RETR_LIST,
                                           cv2.CHAIN_APPROX_SIMPLE)
     contours = np.array([contour for contour in all_contours
@@ -317,36 +533,78 @@ def remove_blobs(image, min_area=0, max_area=sys.maxsize, threshold=128,
     return image, 255 * mask
 
 
+@image_as_array
+def remove_blobs_ranges(image, ranges, threshold=128, method='8-connected',
+                        return_mask=False):
+    """Binarize image using threshold, label its white blobs of connected
+    pixels only once, and for each (min_area, max_area) pair in ranges
+    remove the blobs of that size as remove_blobs(engine='components') does.
+    Returns a list with either the resulting images or, if return_mask is
+    True, their masks, in the same order as ranges."""
+    mono_image = binarize_image(image, method='boolean', threshold=threshold)
+    blobs = get_blobs(mono_image, get_connectivity(method))
+    masks = [get_blobs_mask(blobs, min_area, max_area)
+             for min_area, max_area in ranges]
+    if return_mask:
+        return masks
+    return [cv2.bitwise_and(image, image, mask=mask) for mask in masks]
+
+
+@image_as_array
+def blobs_stats(image, threshold=128, method='8-connected'):
+    """Binarize image using threshold and label its white blobs of connected
+    pixels using 4 or 8 connectivity.
+    Returns a Blobs tuple with the labels image, and arrays with the area in
+    pixels, the bounding box as (x, y, width, height), and the centroid as
+    (x, y) of each blob (ref: utils.get_blobs())."""
+    mono_image = binarize_image(image, method='boolean', threshold=threshold)
+    return get_blobs(mono_image, get_connectivity(method))
+
+
 @image_as_array
 def binarize_image(image, method='li', **kwargs):
     """Binarize image using one of the available methods: 'isodata',
     'li', 'otsu', 'sauvola', and 'boolean'. Defaults to 'li'.
-    Extra keyword arguments are passed in as is to the corresponding
-    scikit-image thresholding function. The 'boolean' method refers to simple
-    thresholding from a grey-scale image. If a 'threshold' kwarg is not passed
-    to the 'boolean' method, 'li' thresholding is performed.
+    Global thresholds ('isodata', 'li', and 'otsu') are calculated from the
+    256 bins histogram of the image, which is also used to detect images that
+    are already binary. Extra keyword arguments ('window_size', 'k', 'r') are
+    passed in as is to the banded 'sauvola' local thresholding (ref:
+    utils.sauvola_binarize()). The 'boolean' method refers
+    to simple thresholding from a grey-scale image. If a 'threshold' kwarg is
+    not passed to the 'boolean' method, 'li' thresholding is performed.
     For reference
     Sezgin M. and Sankur B. (2004) "Survey over Image Thresholding Techniques
     and Quantitative Performance Evaluation" Journal of Electronic Imaging,
     13(1): 146-165 DOI:10.1117/1.1631315
     """
-    if image.ndim != 2:
-        # image is not gray-scale
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    if np.unique(image).size == 2:
+    image = to_gray_uint8(image)
+    histogram = get_gray_histogram(image)
+    if np.count_nonzero(histogram) == 2:
         # image is already binary
         return image
-    boolean_threshold = kwargs.get('threshold', None)
-    if method == 'boolean' and boolean_threshold:
-        preprocessing.binarize(image, threshold=boolean_threshold, copy=False)
-        return convert(image)
-    if method not in ('sauvola', 'isodata', 'otsu', 'li'):
-        method = 'li'
-    thresh_func = getattr(filters.thresholding, "threshold_{}".format(method))
-    threshold = thresh_func(image, **kwargs)
+    boolean_threshold = kwargs.pop('threshold', None)
     # OpenCV can't write black and white images using boolean values, it needs
     # at least a 8bits 1-channel image ranged from 0 (black) to 255 (white)
-    return convert(image <= threshold)
+    if method == 'boolean' and boolean_threshold:
+        _, binary = cv2.threshold(image, boolean_threshold, 255,
+                                  cv2.THRESH_BINARY)
+        return binary
+    if method == 'sauvola':
+        return sauvola_binarize(image, **kwargs)
+    if method not in ('isodata', 'otsu', 'li'):
+        method = 'li'
+    threshold = histogram_thresholds(histogram, [method])[method]
+    _, binary = cv2.threshold(image, threshold, 255, cv2.THRESH_BINARY_INV)
+    return binary
+
+
+@image_as_array
+def binarization_thresholds(image, methods=('isodata', 'li', 'otsu')):
+    """Calculate at once the global thresholds of image for methods, which
+    can be 'isodata', 'li', and 'otsu' (ref: binarize_image()).
+    Returns a dictionary with methods as keys and thresholds as values."""
+    image = to_gray_uint8(image)
+    return histogram_thresholds(get_gray_histogram(image), methods)
 
 
 @image_as_array
@@ -357,22 +615,19 @@ def dilate_image(image, dilation=1, passes=1, binarization=None,
     If image is not black and white, a binarization process is applied
     according to binarization, which can be 'sauvola', 'isodata', 'otsu',
     'li' (default, ref: binarize()).
+    Since repeated dilations with a square are equivalent to a single one with
+    the sum of their radii, passes are merged into one dilation that runs on
+    the 8 bits binary image (ref: utils.dilate_square()).
     """
     # if image is all one single color, return it
-    if len(np.unique(image)) == 1:
+    if image.min() == image.max():
         return image
-    # scikit-image needs only 0's and 1's
-    mono_image = binarize_image(image, method=binarization) / 255
+    mono_image = binarize_image(image, method=binarization)
     if invert:
-        mono_image = invert_image(mono_image)
-    if dilation:
-        dilation = (2 * dilation) + 1
-        dilation_kernel = np.ones((dilation, dilation), np.uint8)
-        dilated = cv2.morphologyEx(mono_image, cv2.MORPH_DILATE,
-                                   dilation_kernel, iterations=passes)
-    else:
-        dilated = mono_image
-    return dilated.astype(np.ubyte) * 255
+        mono_image = cv2.bitwise_not(mono_image)
+    if dilation and passes:
+        return dilate_square(mono_image, dilation * passes)
+    return mono_image
 
 
 @image_as_array
@@ -393,27 +648,24 @@ def skeletonize_image(image, method=None, dilation=None, binarization=None,
     see http://scikit-image.org/docs/dev/auto_examples/edges/plot_skeleton.html
     """
     # if image is all one single color, return it
-    if len(np.unique(image)) == 1:
+    if image.min() == image.max():
         return image
     # Dilation also binarizes the image
-    mono_image = dilate_image(image, dilation=dilation, invert=invert,
-                              binarization=binarization) / 255
-    with warnings.catch_warnings(record=True):
-        warnings.filterwarnings('ignore', category=UserWarning)
-        if method == '3d':
-            skeleton = morphology.skeletonize_3d(mono_image)
-        elif method == 'medial':
-            skeleton = morphology.medial_axis(mono_image,
-                                              return_distance=False)
-        elif method == 'thin':
-            skeleton = morphology.thin(mono_image)
-        elif method == 'combined':
-            skeleton = (morphology.skeletonize_3d(mono_image)
-                        | morphology.medial_axis(mono_image,
-                                                 return_distance=False)
-                        | morphology.skeletonize(mono_image))
-        else:
-            skeleton = morphology.skeletonize(mono_image)
+    dilated = dilate_image(image, dilation=dilation, invert=invert,
+                           binarization=binarization)
+    # The boolean image is computed once and shared by all the operators,
+    # which only need to see the bounding box of the white pixels plus a
+    # 1 pixel wide black margin
+    mono_image = dilated > 0
+    rows = np.flatnonzero(mono_image.any(axis=1))
+    columns = np.flatnonzero(mono_image.any(axis=0))
+    if not rows.size:
+        return convert(mono_image)
+    box = (slice(max(rows[0] - 1, 0), rows[-1] + 2),
+           slice(max(columns[0] - 1, 0), columns[-1] + 2))
+    cropped = get_skeleton(np.ascontiguousarray(mono_image[box]), method)
+    skeleton = np.zeros(mono_image.shape, dtype=cropped.dtype)
+    skeleton[box] = cropped
     return convert(skeleton)
 
 
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import sys
+from itertools import chain
 
 import click
 import cv2
@@ -7,9 +8,12 @@ import cv2
 from .api import (
     adjust_brightness,
     adjust_contrast,
+    adjust_point_operations,
     auto_clean,
     binarize_image,
+    brightness_operation,
     color_reduction,
+    contrast_operation,
     denoise_image,
     dilate_image,
     extract_edges,
@@ -17,6 +21,8 @@ from .api import (
     histogram_image,
     histogram_palette,
     match_templates,
+    match_templates_batch,
+    match_templates_thresholds,
     remove_blobs,
     remove_ridges,
     select_colors,
@@ -28,6 +34,7 @@ from .utils import (
     Image,
     JSONStream,
     RAW,
+    TemplateBank,
     edges_to_graph,
     get_images,
     get_mask_polygons,
@@ -41,6 +48,13 @@ from .utils import (
 )
 
 
+# Actions of the pipeline that can be expressed as point operations
+POINT_OPERATIONS = {
+    'brightness': lambda value: brightness_operation(value),
+    'contrast': lambda value: contrast_operation(value),
+}
+
+
 @click.group(invoke_without_command=True)
 @click.option('--rst', is_flag=True, help='Show help in ReST format.')
 @click.version_option()
@@ -56,7 +70,16 @@ def main(rst=None):
         click.echo(comamnds_text)
         click.echo('-' * len(comamnds_text))
         click.echo()
+        commands = []
         for command_name, command in sorted(main.commands.items()):
+            if isinstance(command, click.Group):
+                # subcommands are documented as "group subcommand"
+                commands.extend(
+                    ("{} {}".format(command_name, name), subcommand)
+                    for name, subcommand in sorted(command.commands.items()))
+            else:
+                commands.append((command_name, command))
+        for command_name, command in commands:
             click.echo(command_name)
             click.echo('~' * len(command_name))
             click.echo(command.get_usage(ctx)
@@ -94,6 +117,8 @@ def pipeline(image, actions):
         histonets pipeline '[{"action": "contrast", "options": {"value": 50}}]'
     """
     output = image.image
+    # consecutive point operations are fused into a single lookup table
+    point_operations = []
     for action in actions:
         ctx = click.get_current_context()
         arguments = [output] + action.get('arguments', [])
@@ -104,11 +129,24 @@ def pipeline(image, actions):
         action_options = action.get('options', {})
         options = {param.name: action_options.get(param.name, param.default)
                    for param in command.params[:-2]}
+        if action['action'] in POINT_OPERATIONS and len(arguments) == 1:
+            operation = POINT_OPERATIONS[action['action']]
+            try:
+                point_operations.append(operation(**options))
+            except TypeError as e:
+                raise click.BadParameter(e)
+            continue
+        if point_operations:
+            output = adjust_point_operations(output, point_operations)
+            arguments[0] = output
+            point_operations = []
         options['output'] = RAW
         try:
             output = command.callback(*arguments, **options)
         except TypeError as e:
             raise click.BadParameter(e)
+    if point_operations:
+        output = adjust_point_operations(output, point_operations)
     return output
 
 
@@ -143,13 +181,21 @@ def brightness(image, value):
 
 @main.command()
 @click.argument("value", type=click.IntRange(0, 100))
+@click.option('-m', '--method',
+              type=Choice(['bilateral', 'guided']),
+              default='bilateral',
+              help='Edge-preserving filter to use. \'bilateral\' applies '
+                   'a bilateral filter, which gets slower as VALUE grows; '
+                   '\'guided\' runs a fast approximation using a guided '
+                   'filter, whose cost does not depend on VALUE. '
+                   'Defaults to \'bilateral\'.')
 @io_handler
-def smooth(image, value):
+def smooth(image, value, method):
     """Smooth IMAGE using bilateral filter.
 
     \b
     - VALUE ranges from 0 to 100."""
-    return smooth_image(image, value)
+    return smooth_image(image, value, method)
 
 
 @main.command()
@@ -165,13 +211,28 @@ def equalize(image, value):
 
 @main.command()
 @click.argument("value", type=click.IntRange(0, 100))
+@click.option('-l', '--luma', is_flag=True,
+              help='Denoise only the luma channel and keep the chroma '
+                   'channels as they are. Faster but lower quality.')
+@click.option('-a', '--auto', is_flag=True,
+              help='Estimate the strength of the filter from the level of '
+                   'noise of a sample of IMAGE, ignoring VALUE.')
+@click.option('-f', '--fast', is_flag=True,
+              help='Use smaller template and search windows. '
+                   'Faster but lower quality.')
+@click.option('-s', '--scale', type=click.IntRange(1, 100),
+              default=100,
+              help='Percentage of the size of IMAGE to denoise at, the result '
+                   'is then used to guide the denoising of IMAGE at full '
+                   'resolution. Ranges from 1 to 100. Defaults to 100 '
+                   '(no downscaling).')
 @io_handler
-def denoise(image, value):
+def denoise(image, value, luma, auto, fast, scale):
     """Denoise IMAGE.
 
     \b
     - VALUE ranges from 0 to 100."""
-    return denoise_image(image, value)
+    return denoise_image(image, value, luma, auto, fast, scale)
 
 
 @main.command()
@@ -307,7 +368,7 @@ def enhance(image, palette):
 
 
 @main.command()
-@click.argument('templates', nargs=-1, required=True, callback=get_images)
+@click.argument('templates', nargs=-1, callback=get_images)
 @click.option('-th', '--threshold', type=click.IntRange(0, 100),
               multiple=True,
               help='Threshold to match TEMPLATE to IMAGE. '
@@ -323,13 +384,68 @@ def enhance(image, palette):
                    'specify regions to cut out when matching. '
                    'For example, [[[50,50],[120,50],[120,82],[50,82]]] '
                    'is a list that contains one single polygon.')
+@click.option('-j', '--jobs', type=click.IntRange(1, None), default=1,
+              help='Number of threads to match templates and their flips '
+                   'in parallel. Defaults to 1.')
+@click.option('-en', '--engine', type=click.Choice(['opencv', 'fft']),
+              default='opencv',
+              help='Engine to correlate templates without excluded regions. '
+                   '"fft" shares the work on IMAGE across templates of the '
+                   'same size. Defaults to "opencv".')
+@click.option('-p', '--pyramid', type=click.IntRange(0, 8), default=0,
+              help='Number of times to downscale IMAGE and TEMPLATES by 2 '
+                   'to search coarse-to-fine, refining only around the '
+                   'candidates at full resolution. '
+                   'Ranges from 0 to 8. Defaults to 0 (exhaustive search).')
+@click.option('-s', '--suppression', type=click.Choice(['template', 'global']),
+              default='template',
+              help='Whether overlapping matches are suppressed only among '
+                   'matches of the same TEMPLATE and its flips, or among '
+                   'all of them. Defaults to "template".')
+@click.option('-pk', '--peaks', is_flag=True,
+              help='Only consider the locations where the score is a local '
+                   'maximum, which speeds up suppression with low '
+                   'thresholds.')
+@click.option('-mm', '--max-matches', type=click.IntRange(1, None),
+              help='Maximum number of matches to return for each TEMPLATE, '
+                   'keeping the best scoring ones. Defaults to no limit.')
+@click.option('-sw', '--sweep', type=click.IntRange(0, 100), multiple=True,
+              help='Threshold to match all TEMPLATES to IMAGE. It can be '
+                   'repeated to compute the matches for several thresholds '
+                   'in one single pass, returning them by threshold.')
+@click.option('-r', '--region', callback=parse_jsons, multiple=True,
+              help='JSON polygon expressed as [x, y] points, or rectangle '
+                   'expressed as its [x1, y1] and [x2, y2] corners, of a '
+                   'region of IMAGE to look for TEMPLATES in. It can be '
+                   'repeated, and only matches centered inside the regions '
+                   'are returned. For example, [[50,50],[120,82]]. '
+                   'Defaults to the whole IMAGE.')
+@click.option('-ts', '--tile-size', type=click.IntRange(1, None),
+              help='Side in pixels of the tiles to match IMAGE tile by tile, '
+                   'so memory depends on the size of the tiles and not on '
+                   'the size of IMAGE. Defaults to no tiling.')
+@click.option('-pg', '--page', multiple=True,
+              help='Path to a local (file://) or remote (http://, https://) '
+                   'image file of another page to look for TEMPLATES in, '
+                   'after IMAGE. It can be repeated, and then the matches '
+                   'are returned as a list with the matches of each page.')
+@click.option('-pj', '--page-jobs', type=click.IntRange(1, None), default=1,
+              help='Number of threads to match pages in parallel, '
+                   'preparing TEMPLATES only once for all of them. '
+                   'Defaults to 1.')
+@click.option('-b', '--bank', type=click.Path(file_okay=False),
+              help='Directory of a bank of templates with their features '
+                   'already computed (see "templates build") to use instead '
+                   'of TEMPLATES.')
 @io_handler
 @pair_options_to_argument('templates', {
     'threshold': 80,
     'flip': None,
     'exclude_regions': None,
 })
-def match(image, templates, threshold, flip, exclude_regions):
+def match(image, templates, threshold, flip, exclude_regions, jobs, engine,
+          pyramid, suppression, peaks, max_matches, sweep, region, tile_size,
+          page, page_jobs, bank):
     """Look for TEMPLATES in IMAGE and return the bounding boxes of
     the matches. Options may be provided after each TEMPLATE.
 
@@ -340,6 +456,55 @@ def match(image, templates, threshold, flip, exclude_regions):
     \b
     - TEMPLATE is a path to a local (file://) or remote (http://, https://)
       image file of the template to look for."""
+    options = dict(workers=jobs, engine=engine, pyramid=pyramid,
+                   suppression=suppression, peaks=peaks,
+                   max_matches=max_matches, regions=region or None,
+                   tile_size=tile_size)
+    if bank is not None:
+        if templates:
+            raise click.BadParameter('Either TEMPLATES or a bank are needed, '
+                                     'but not both.')
+        try:
+            image_templates = TemplateBank.load(bank)
+        except (OSError, ValueError, KeyError):
+            raise click.BadParameter('Template bank is missing or malformed.')
+    else:
+        image_templates = get_match_templates(templates, threshold, flip,
+                                              exclude_regions)
+    if page:
+        if sweep:
+            raise click.BadParameter('Sweep only supports one single page.')
+        pages = chain([image], (get_page(value) for value in page))
+        pages_matches = [None] * (len(page) + 1)
+        for position, matches in match_templates_batch(
+                pages, image_templates, batch_workers=page_jobs, **options):
+            pages_matches[position] = matches.tolist()
+        return pages_matches
+    if sweep:
+        sweep_matches = match_templates_thresholds(image, image_templates,
+                                                   sweep, **options)
+        return {value: matches.tolist()
+                for value, matches in zip(sweep, sweep_matches)}
+    matches = match_templates(image, image_templates, **options)
+    return matches.tolist()
+
+
+def get_page(value):
+    """Load the image of a page of the match command, only when it is about
+    to be matched"""
+    try:
+        return Image.get_images([value])[0]
+    except Exception as e:
+        # Image.get_images() wraps the original error as a message
+        raise click.BadParameter('Page {} cannot be loaded: {}'.format(
+            value, getattr(e, 'message', e)))
+
+
+def get_match_templates(templates, threshold, flip, exclude_regions):
+    """Build the list of templates to match (ref: match_templates()) from
+    the TEMPLATES of the match command and their paired options"""
+    if not templates:
+        raise click.BadParameter('Either TEMPLATES or a bank are needed.')
     # TODO: Click invoke fails at testing time, but not at runtime :(
     #       template options should be a list of the same length that templates
     none_list = [None] * len(templates)
@@ -367,8 +532,67 @@ def match(image, templates, threshold, flip, exclude_regions):
             'flip': template_flip,
             'mask': mask,
         })
-    matches = match_templates(image, image_templates)
-    return matches.tolist()
+    return image_templates
+
+
+@main.group()
+def templates():
+    """Build banks of templates to match."""
+
+
+@templates.command('build')
+@click.argument('templates', nargs=-1, required=True, callback=get_images)
+@click.argument('bank', type=click.Path(file_okay=False))
+@click.option('-th', '--threshold', type=click.IntRange(0, 100),
+              multiple=True,
+              help='Threshold to match TEMPLATE to images. '
+                   'Ranges from 0 to 100. Defaults to 80.')
+@click.option('-f', '--flip', type=click.Choice(
+                ['horizontal', 'h', 'vertical', 'v', 'both', 'b', 'all', 'a']),
+              multiple=True,
+              help='Whether also match TEMPLATE flipped horizontally. '
+                   'vertically, or both. Defaults to not flipping.')
+@click.option('-e', '--exclude-regions', callback=parse_jsons,
+              multiple=True,
+              help='JSON list of polygons expressed as [x, y] points to '
+                   'specify regions to cut out when matching. '
+                   'For example, [[[50,50],[120,50],[120,82],[50,82]]] '
+                   'is a list that contains one single polygon.')
+@click.option('-p', '--pyramid', type=click.IntRange(0, 8), default=0,
+              help='Number of downscaled versions of TEMPLATES to prepare '
+                   'for coarse-to-fine matching. '
+                   'Ranges from 0 to 8. Defaults to 0.')
+@click.option('-ps', '--page-size', type=click.IntRange(1, None), nargs=2,
+              help='Width and height of the images to match, to also '
+                   'prepare the spectra of TEMPLATES for the "fft" engine.')
+@click.option('-ow', '--overwrite', is_flag=True,
+              help='Replace the bank if BANK already contains one.')
+@pair_options_to_argument('templates', {
+    'threshold': 80,
+    'flip': None,
+    'exclude_regions': None,
+}, args_slice=(2, -1))
+def build(templates, bank, threshold, flip, exclude_regions, pyramid,
+          page_size, overwrite):
+    """Prepare TEMPLATES for matching and save them with their features
+    to the directory BANK, to be used by "histonets match -b BANK".
+    Options may be provided after each TEMPLATE.
+
+    Example::
+
+      histonets templates build http://foo.bar/tmpl1 -th 50 -f h bank/
+
+    \b
+    - TEMPLATE is a path to a local (file://) or remote (http://, https://)
+      image file of the template to look for."""
+    image_templates = get_match_templates(templates, threshold, flip,
+                                          exclude_regions)
+    shape = tuple(page_size[::-1]) if page_size else None
+    try:
+        TemplateBank(image_templates, pyramid, shape).save(bank, overwrite)
+    except FileExistsError:
+        raise click.BadParameter('BANK already contains a template bank. '
+                                 'Use --overwrite to replace it.')
 
 
 @main.command()
@@ -399,9 +623,10 @@ def select(image, colors, tolerance, mask):
 
 @main.command()
 @click.option('-w', '--width', type=click.IntRange(1, 100),
-              default=6,
+              default=[6], multiple=True,
               help='Width in pixels of the ridges to detect. '
-                   'Ranges from 1 to 100. Defaults to 6.')
+                   'Ranges from 1 to 100. Defaults to 6. '
+                   'It can be repeated to detect several widths in one pass.')
 @click.option('-th', '--threshold', type=click.IntRange(0, 255),
               default=128,
               help='Threshold to binarize detected ridges. '
@@ -410,17 +635,21 @@ def select(image, colors, tolerance, mask):
               default=1,
               help='Dilation radius to thicken the mask of detected ridges. '
                    'Ranges from 0 to 100. Defaults to 1.')
+@click.option('-ds', '--downsample', is_flag=True,
+              help='Detect wide ridges on a downsampled image, which is '
+                   'faster but less accurate.')
 @click.option('-m', '--mask', is_flag=True,
               help='Returns a black and white mask instead.')
 @io_handler
-def ridges(image, width, threshold, dilation, mask):
+def ridges(image, width, threshold, dilation, downsample, mask):
     """Remove ridges from IMAGE, turning them into black.
 
     Example::
 
       histonets ridges --width 6 file://...
     """
-    return remove_ridges(image, width, threshold, dilation, return_mask=mask)
+    return remove_ridges(image, width, threshold, dilation, downsample,
+                         return_mask=mask)
 
 
 @main.command()
@@ -442,10 +671,17 @@ def ridges(image, width, threshold, dilation, mask):
                    'neighborhood (top, right, bottom, left), 8 pixels (all '
                    'around), or 16 pixels (anti-aliased). '
                    'Defaults to 4 neighbors.')
+@click.option('-e', '--engine', type=click.Choice(['contours', 'components']),
+              default='contours',
+              help='Engine to detect and measure blobs. Contours measures '
+                   'the area of the blob outline polygon, while components '
+                   'labels connected pixels and counts them, which is '
+                   'faster. Defaults to contours.')
 @click.option('-m', '--mask', is_flag=True,
               help='Returns a black and white mask instead.')
 @io_handler
-def blobs(image, minimum_area, maximum_area, threshold, connectivity, mask):
+def blobs(image, minimum_area, maximum_area, threshold, connectivity, engine,
+          mask):
     """Binarize using threshold and remove white blobs of contiguous pixels
     of size between min and max from IMAGE, turning them into black.
 
@@ -455,7 +691,7 @@ def blobs(image, minimum_area, maximum_area, threshold, connectivity, mask):
     """
     method = "{}-connected".format(connectivity)
     return remove_blobs(image, minimum_area, maximum_area, threshold, method,
-                        return_mask=mask)
+                        engine=engine, return_mask=mask)
 
 
 @main.command()
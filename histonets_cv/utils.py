@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import base64
 import collections
+import functools
 import gzip
 import heapq
 import imghdr
@@ -8,7 +9,9 @@ import json
 import locale
 import os
 import sys
+import threading
 import warnings
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from itertools import chain
 from urllib.parse import urlparse
 from urllib.request import urlopen
@@ -26,6 +29,7 @@ from scipy.sparse.csgraph import floyd_warshall
 from scipy.spatial.distance import sqeuclidean as squared_euclidean
 from skimage import filters as skfilters
 from skimage import draw
+from skimage import morphology
 from sklearn.cluster import MiniBatchKMeans
 from sklearn.preprocessing import minmax_scale
 from sklearn.utils.validation import DataConversionWarning
@@ -34,6 +38,40 @@ from sklearn.utils.validation import DataConversionWarning
 # Constants
 RAW = 'raw'
 IMAGE = 'image'
+Blobs = collections.namedtuple(
+    'Blobs', ['labels', 'areas', 'bboxes', 'centroids']
+)
+# Radius from which dilating with a distance transform is faster
+DISTANCE_DILATION_RADIUS = 256
+# Largest sigma at which ridges are detected when downsampling is allowed
+COARSE_RIDGES_SIGMA = 2
+# Number of template shapes whose window norms an image keeps at once
+WINDOW_NORMS_SHAPES = 4
+# Decrease of the threshold to keep candidates at coarse pyramid levels
+PYRAMID_RELAXATION = 0.2
+# Smallest side in pixels of a template at a coarse pyramid level
+PYRAMID_MIN_SIZE = 8
+# Number of ORB keypoints detected in templates and in images
+KEYPOINTS_TEMPLATE_FEATURES = 500
+KEYPOINTS_IMAGE_FEATURES = 5000
+# Largest ratio of the distances of the best and second best descriptor
+# matches to keep a keypoint match (Lowe's ratio test)
+KEYPOINTS_RATIO = 0.8
+# Smallest number of keypoint matches agreeing on a transformation
+KEYPOINTS_MIN_MATCHES = 10
+# Largest distance in pixels of a keypoint to its transformed match
+KEYPOINTS_REPROJECTION = 3.0
+# Number of transformations tried by RANSAC on keypoint matches
+KEYPOINTS_HYPOTHESES = 1000
+# Distance in pixels to the closest edge from which chamfer matching
+# considers a template edge point unmatched
+CHAMFER_DISTANCE = 10
+# Smallest normalized correlation coefficient between two templates of a
+# bank to group them as near-duplicates, matched only once
+DUPLICATE_TEMPLATE_SCORE = 0.98
+# Extra padding in pixels of search regions so edge maps are not affected
+# by the borders of the crops
+REGION_MARGIN = 8
 
 
 class Stream(click.ParamType):
@@ -160,6 +198,51 @@ class Image(object):
         return images
 
 
+class PointOperation(object):
+    """Per-pixel operation on 8 bits images expressed as a 256 entries lookup
+    table. Operations can be chained with then() so a whole series of
+    adjustments is fused into a single table and applied in one pass"""
+    __slots__ = ('table', )
+
+    def __init__(self, table=None):
+        if table is None:
+            table = np.arange(256, dtype=np.uint8)  # identity
+        self.table = np.asarray(table, dtype=np.uint8).reshape(256)
+
+    @classmethod
+    def from_function(cls, func):
+        """Build the lookup table by evaluating func over all the possible
+        values of a pixel, clipping the result to the range 0 to 255"""
+        values = func(np.arange(256, dtype=np.float64))
+        return cls(np.clip(values, 0, 255).astype(np.uint8))
+
+    @classmethod
+    def scale(cls, factor):
+        """Multiply every pixel value by factor"""
+        return cls.from_function(lambda values: values * factor)
+
+    @classmethod
+    def shift(cls, offset):
+        """Add offset to every pixel value"""
+        return cls.from_function(lambda values: values + offset)
+
+    @classmethod
+    def stretch(cls, low, high):
+        """Linearly map values from low to high onto the full 0 to 255
+        range"""
+        return cls.from_function(
+            lambda values: (values - low) / (high - low) * 255)
+
+    def then(self, other):
+        """Return a new operation that applies self and then other"""
+        return PointOperation(other.table[self.table])
+
+    def __call__(self, image, inplace=False):
+        if inplace:
+            return cv2.LUT(image, self.table, dst=image)
+        return cv2.LUT(image, self.table)
+
+
 def image_as_array(f):
     """Decorator to handle image as Image and as numpy array"""
 
@@ -326,30 +409,43 @@ def pair_options_to_argument(argument, options, args=None, args_slice=None):
     def func(f):
         def wrapper(*args, **kwargs):
             ctx = click.get_current_context()
-            append = ''
-            os_args = []
-            for os_arg in (_args or get_os_args())[slice(*args_slice)]:
-                if os_arg.startswith('-'):
-                    append = os_arg
-                else:
-                    os_args.append(("{}\b".format(append), os_arg))
-                    append = ''
             params = {}
             defaults = {}
+            values = {}
             for param in ctx.command.get_params(ctx):
+                if isinstance(param, click.Option):
+                    for opt in param.opts + param.secondary_opts:
+                        values[opt] = (0 if param.is_flag or param.count
+                                       else param.nargs)
                 if param.name in options.keys():
                     params[param.name] = param.opts
                     defaults[param.name] = param.default
+            option = ''
+            pending = 0
+            os_args = []
+            for os_arg in (_args or get_os_args())[slice(*args_slice)]:
+                if pending:
+                    if pending == values.get(option, 1):
+                        os_args.append((option, os_arg))
+                    pending -= 1
+                elif os_arg.startswith('-') and len(os_arg) > 1:
+                    option, _, value = os_arg.partition('=')
+                    if value:
+                        os_args.append((option, value))
+                    else:
+                        pending = values.get(option, 1)
+                else:
+                    os_args.append(('', os_arg))
             _kwargs = {k: v for k, v in kwargs.items() if k in pairings}
             _params = {k: {} for k, v in params.items()}
             if pairings and os_args:
                 index = 0
-                for prefix, _ in os_args:
-                    if prefix.startswith('\b'):
+                for option, _ in os_args:
+                    if not option:
                         index += 1
                     else:
                         for name, opts in params.items():
-                            if any(prefix.startswith(opt) for opt in opts):
+                            if option in opts:
                                 kw_arg_index = len(_params[name])
                                 kw_arg = kwargs[name][kw_arg_index]
                                 _params[name][index - 1] = kw_arg
@@ -496,6 +592,90 @@ def kmeans(X, n_clusters, **kwargs):
     return centers, labels
 
 
+@functools.lru_cache(maxsize=None)
+def get_clahe(tile_grid_size, clip_limit=1.0):
+    """Return a CLAHE object for tile_grid_size tiles by side, shared across
+    calls with the same settings"""
+    return cv2.createCLAHE(clipLimit=clip_limit,
+                           tileGridSize=(tile_grid_size, tile_grid_size))
+
+
+def dilate_square(image, radius):
+    """Dilate a black and white 8 bits image using a square of side
+    2 * radius + 1 as the structuring element. Small radii use the separable
+    rectangular morphology of OpenCV, while larger ones threshold the
+    chessboard distance transform, whose cost does not depend on radius."""
+    if radius < 1:
+        return image.copy()
+    if radius < DISTANCE_DILATION_RADIUS:
+        size = 2 * radius + 1
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (size, size))
+        return cv2.dilate(image, kernel)
+    # distance of each pixel to the closest white pixel
+    distances = cv2.distanceTransform(cv2.bitwise_not(image), cv2.DIST_C, 3)
+    _, dilated = cv2.threshold(distances, radius, 255, cv2.THRESH_BINARY_INV)
+    return dilated.astype(np.uint8)
+
+
+def get_skeleton(mono_image, method=None):
+    """Run the skeletonization method on the boolean image mono_image
+    (ref: api.skeletonize_image()). The operators of the 'combined' method run
+    concurrently in a pool of threads on the very same image, and their
+    results are merged as in previous versions, with 3d skeleton pixels at 255
+    and the rest at 1."""
+    medial_axis = functools.partial(morphology.medial_axis,
+                                    return_distance=False)
+    operators = {
+        '3d': morphology.skeletonize_3d,
+        'medial': medial_axis,
+        'thin': morphology.thin,
+        'regular': morphology.skeletonize,
+    }
+    with warnings.catch_warnings(record=True):
+        warnings.filterwarnings('ignore', category=UserWarning)
+        if method == 'combined':
+            combined = (operators['3d'], medial_axis, operators['regular'])
+            with ThreadPoolExecutor(max_workers=len(combined)) as executor:
+                skeletons = executor.map(lambda operator: operator(mono_image),
+                                         combined)
+                skeleton = functools.reduce(np.bitwise_or, skeletons)
+        else:
+            operator = operators.get(method, morphology.skeletonize)
+            skeleton = operator(mono_image)
+    return skeleton
+
+
+def get_connectivity(method):
+    """Translate a blobs method name ('4-connected', '8-connected',
+    '16-connected' or 'antialiased') into a pixel connectivity of 4 or 8"""
+    return 4 if method.lower() == '4-connected' else 8
+
+
+def get_blobs(mono_image, connectivity=8):
+    """Label the white blobs of connected pixels of the binary image
+    mono_image using either 4 or 8 connectivity.
+    Returns a Blobs tuple with the labels image, where the background is 0
+    and blob i is labeled i + 1, and the arrays of areas in pixels,
+    bounding boxes as (x, y, width, height), and centroids as (x, y)
+    of each blob."""
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        mono_image, connectivity=connectivity, ltype=cv2.CV_32S)
+    return Blobs(labels=labels,
+                 areas=stats[1:, cv2.CC_STAT_AREA],
+                 bboxes=stats[1:, :cv2.CC_STAT_AREA],
+                 centroids=centroids[1:])
+
+
+def get_blobs_mask(blobs, min_area=0, max_area=sys.maxsize):
+    """Build a mask from a Blobs tuple that is white everywhere except for
+    the blobs of area between min_area and max_area, both inclusive.
+    The mask is built in one pass over the labels image using a lookup
+    table indexed by label."""
+    table = np.full(blobs.areas.size + 1, 255, dtype=np.uint8)
+    table[1:][(blobs.areas >= min_area) & (blobs.areas <= max_area)] = 0
+    return table.take(blobs.labels)
+
+
 def get_mask_polygons(polygons, height, width):
     """Turn a list of polygons into a mask image of height by width.
     Each polygon is expressed as a list of [x, y] points."""
@@ -504,46 +684,1321 @@ def get_mask_polygons(polygons, height, width):
     return mask
 
 
-@image_as_array
+def get_flips(flip=None):
+    """Return the list of transformations to match a template with according
+    to flip, that can be 'horizontal', 'vertical', 'both', 'all', or their
+    initials. The identity is always the first transformation"""
+    transformations = [lambda im: im]
+    if flip:
+        if flip[0] in ('h', 'a'):
+            transformations.append(lambda im: cv2.flip(im, 1))
+        if flip[0] in ('v', 'a'):
+            transformations.append(lambda im: cv2.flip(im, 0))
+        if flip[0] in ('b', 'a'):
+            transformations.append(lambda im: cv2.flip(im, -1))
+    return transformations
+
+
+def get_edges(image, method, lower=None, upper=None):
+    """Compute the edge map of a gray-scale 8 bits image using method, that
+    can be either of ('laplacian', 'sobel', 'scharr', 'prewitt', 'roberts',
+    'canny'). The lower and upper thresholds are only used by 'canny'."""
+    if method == 'laplacian':
+        # use CV_64F to not loose edges, convert to uint8 afterwards
+        return np.uint8(np.absolute(cv2.Laplacian(image, cv2.CV_64F)))
+    elif method in ('sobel', 'scharr', 'prewitt', 'roberts'):
+        filter_func = getattr(skfilters, method)
+        return convert(filter_func(image))
+    else:  # method == 'canny'
+        return cv2.Canny(image, lower, upper)
+
+
+def get_canny_thresholds(median, sigma=0.33):
+    """Return the lower and upper Canny thresholds around median using
+    sigma"""
+    return (int(max(0, (1.0 - sigma) * median)),
+            int(min(255, (1.0 + sigma) * median)))
+
+
+def histogram_median(histogram):
+    """Calculate the median of the values counted in a 256 bins histogram,
+    averaging the two middle values for an even number of values, as
+    np.median does"""
+    cumulative = np.cumsum(histogram)
+    total = cumulative[-1]
+    upper = np.searchsorted(cumulative, total // 2, side='right')
+    if total % 2:
+        return float(upper)
+    lower = np.searchsorted(cumulative, total // 2 - 1, side='right')
+    return (lower + upper) / 2
+
+
+class CachedFeatures(object):
+    """Base class for objects whose features are computed only once, the
+    first time they are needed. Features can safely be requested from
+    several threads, and different features are computed concurrently"""
+    __slots__ = ('_features', '_locks', '_lock')
+
+    def __init__(self):
+        self._features = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key, func, *args):
+        """Return the feature stored under key, calculating it as
+        func(*args) if missing. Only threads requesting the same missing
+        feature wait for each other"""
+        try:
+            return self._features[key]
+        except KeyError:
+            pass
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._features:
+                self._features[key] = func(*args)
+            return self._features[key]
+
+    def export_features(self):
+        """Return the features computed so far as a dictionary"""
+        with self._lock:
+            return dict(self._features)
+
+    def import_features(self, features):
+        """Add features, a dictionary as export_features() returns, to the
+        features computed so far"""
+        with self._lock:
+            self._features.update(features)
+
+
+class MatchingImage(CachedFeatures):
+    """Gray-scale image to match templates against. Its histogram, its edge
+    maps, its spectrum and its window statistics are computed only once,
+    the first time they are needed, and then shared by all the templates
+    and transformations matched against it"""
+    __slots__ = ('image', '_parent', '_window_shapes')
+
+    def __init__(self, image):
+        super().__init__()
+        if isinstance(image, Image):
+            image = image.image
+        self.image = to_gray_uint8(image)
+        self._parent = None
+        self._window_shapes = collections.OrderedDict()
+
+    @property
+    def histogram(self):
+        if self._parent is not None:
+            return self._parent[0].histogram
+        return self._cached('histogram', get_gray_histogram, self.image)
+
+    def median(self, template=None):
+        """Median of the values of the image, together with the values of
+        template if given"""
+        histogram = self.histogram
+        if isinstance(template, MatchingTemplate):
+            histogram = histogram + template.histogram
+        elif template is not None:
+            histogram = histogram + np.bincount(template.ravel(),
+                                                minlength=256)
+        return histogram_median(histogram)
+
+    def edges(self, method, lower=None, upper=None, level=0):
+        """Edge map of the image using method (ref: get_edges()), downscaled
+        level times by a factor of 2 if level is given"""
+        if self._parent is not None and self._parent[1] is not None:
+            parent, box = self._parent
+            return parent.edges(method, lower, upper)[box]
+        key = (method, lower, upper) if method == 'canny' else (method, )
+        if level > 0:
+            return self._cached(('edges', level) + key, lambda: cv2.pyrDown(
+                self.edges(method, lower, upper, level - 1)))
+        return self._cached(('edges', ) + key, get_edges, self.image, method,
+                            lower, upper)
+
+    @property
+    def spectrum(self):
+        """Spectrum of the zero mean image, padded to an optimal size for the
+        discrete Fourier transform, in OpenCV packed format"""
+        return self._cached('spectrum', get_spectrum, self.image)
+
+    @property
+    def squares_spectrum(self):
+        """Spectrum of the squares of the zero mean image, padded as
+        spectrum"""
+        return self._cached('squares_spectrum', get_spectrum, self.image,
+                            True)
+
+    def crop(self, top, bottom, left, right, edges=True):
+        """Return the MatchingImage of a region of the image. Its histogram
+        and, unless edges is False, its edge maps are those of the whole
+        image, so matching in the region gives the same results as matching
+        in the whole image. With edges False, edge maps are computed only
+        for the region, which is cheaper when the whole image is not
+        needed"""
+        box = (slice(top, bottom), slice(left, right))
+        cropped = MatchingImage(self.image[box])
+        cropped._parent = (self, box if edges else None)
+        return cropped
+
+    def pyramid(self, level):
+        """Return the MatchingImage of the image downscaled level times by
+        a factor of 2 (ref: cv2.pyrDown())"""
+        if level <= 0:
+            return self
+        return self._cached(('pyramid', level), lambda: MatchingImage(
+            cv2.pyrDown(self.pyramid(level - 1).image)))
+
+    @property
+    def distances(self):
+        """Distance from every pixel of the image to its closest Canny
+        edge, with Canny thresholds set from the median of the image,
+        truncated to CHAMFER_DISTANCE"""
+        if self._parent is not None and self._parent[1] is not None:
+            parent, box = self._parent
+            return parent.distances[box]
+        return self._cached('distances', lambda: np.minimum(
+            cv2.distanceTransform(np.uint8(self.edges(
+                'canny', *get_canny_thresholds(self.median())) == 0),
+                cv2.DIST_L2, 3), CHAMFER_DISTANCE))
+
+    @property
+    def keypoints(self):
+        """ORB keypoints of the image and their descriptors (ref:
+        get_keypoints())"""
+        return self._cached('keypoints', get_keypoints, self.image,
+                            KEYPOINTS_IMAGE_FEATURES)
+
+    def window_norms(self, shape):
+        """Norm of the zero mean window of image of shape at every position
+        a template of that shape fits in (ref: get_window_norms()). Only the
+        norms of the WINDOW_NORMS_SHAPES most recently used shapes are kept,
+        since each one takes as much memory as the image"""
+        key = ('window_norms', tuple(shape))
+        norms = self._cached(key, get_window_norms, self.image, shape)
+        with self._lock:
+            self._window_shapes[key] = None
+            self._window_shapes.move_to_end(key)
+            while len(self._window_shapes) > WINDOW_NORMS_SHAPES:
+                oldest, _ = self._window_shapes.popitem(last=False)
+                self._features.pop(oldest, None)
+        return norms
+
+
+class MatchingTemplate(CachedFeatures):
+    """Gray-scale template to match, with an optional mask whose non-zero
+    values are the pixels to match. Its histogram, its edge maps, its zero
+    mean versions, its spectra and its downscaled versions are computed only
+    once, and then shared by all the images it is matched against. They can
+    also be saved and loaded (ref: TemplateBank).
+    If the template is a near-duplicate of another one, representative is
+    that template, matched instead (ref: group_duplicate_templates())"""
+    __slots__ = ('image', 'mask', 'representative')
+
+    def __init__(self, image, mask=None):
+        super().__init__()
+        self.image = to_gray_uint8(image)
+        self.mask = mask
+        self.representative = None
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def histogram(self):
+        return self._cached('histogram', lambda: np.bincount(
+            self.image.ravel(), minlength=256))
+
+    def edges(self, method, lower=None, upper=None, level=0):
+        """Edge map of the template using method (ref: get_edges()), with
+        the mask eroded applied, and downscaled level times by a factor of 2
+        if level is given"""
+        key = (method, lower, upper) if method == 'canny' else (method, )
+        if level > 0:
+            return self._cached(('edges', level) + key, lambda: cv2.pyrDown(
+                self.edges(method, lower, upper, level - 1)))
+        return self._cached(('edges', ) + key, self._masked_edges, method,
+                            lower, upper)
+
+    def _masked_edges(self, method, lower, upper):
+        edges = get_edges(self.image, method, lower, upper)
+        if self.mask is not None:
+            edges &= cv2.erode(self.mask, np.ones((3, 3), np.uint8))
+        return edges
+
+    @property
+    def zero_mean(self):
+        """Template minus its mean, or minus the mean of its masked pixels
+        and with the rest set to 0 if it has a mask, as float32"""
+        return self._cached('zero_mean', self._zero_mean)
+
+    def _zero_mean(self):
+        zero_mean = self.image.astype(np.float32)
+        if self.mask is None:
+            zero_mean -= zero_mean.mean()
+        elif self.mask.any():
+            zero_mean -= zero_mean[self.mask > 0].mean()
+            zero_mean *= self.weights
+        return zero_mean
+
+    @property
+    def weights(self):
+        """Mask as float32 ones and zeros"""
+        return self._cached('weights', lambda: (
+            np.ones(self.shape) if self.mask is None else self.mask > 0
+        ).astype(np.float32))
+
+    @property
+    def norm(self):
+        """Norm of the zero mean template"""
+        return self._cached('norm', lambda: np.sqrt(np.square(
+            self.zero_mean, dtype=np.float64).sum()))
+
+    @property
+    def edge_kernel(self):
+        """Canny edges of the template inside its eroded mask, with Canny
+        thresholds set from the median of the template, as float32 ones and
+        zeros"""
+        return self._cached('edge_kernel', lambda: (self.edges(
+            'canny', *get_canny_thresholds(
+                histogram_median(self.histogram))) > 0).astype(np.float32))
+
+    @property
+    def keypoints(self):
+        """ORB keypoints of the template inside its mask and their
+        descriptors (ref: get_keypoints())"""
+        return self._cached('keypoints', get_keypoints, self.image,
+                            KEYPOINTS_TEMPLATE_FEATURES, self.mask)
+
+    def spectrum(self, shape, weights=False):
+        """Spectrum of the zero mean template, or of its weights if weights
+        is True, padded with zeros to shape"""
+        key = ('spectrum', tuple(shape), weights)
+        kernel = self.weights if weights else self.zero_mean
+        return self._cached(key, get_kernel_spectrum, kernel, shape)
+
+    def pyramid(self, level):
+        """Return the MatchingTemplate of the template downscaled level
+        times by a factor of 2 (ref: cv2.pyrDown()), with its mask resized
+        accordingly"""
+        if level <= 0:
+            return self
+        return self._cached(('pyramid', level), self._pyramid, level)
+
+    def prepare(self, method, levels=0, shape=None):
+        """Compute the features needed to match the template using method,
+        also for levels downscaled versions, and, if shape is given, its
+        spectra padded to shape. Canny edge maps are left out, since their
+        thresholds depend on the image the template is matched against"""
+        for level in range(levels + 1):
+            template = self.pyramid(level)
+            template.histogram
+            template.norm
+            if method == 'chamfer':
+                template.edge_kernel
+            elif self.mask is not None and method in (
+                    'laplacian', 'sobel', 'scharr', 'prewitt', 'roberts'):
+                self.edges(method, level=level)
+        if method == 'orb':
+            self.keypoints
+        if shape is not None:
+            self.spectrum(shape)
+            if self.mask is not None:
+                self.spectrum(shape, weights=True)
+        return self
+
+    def _pyramid(self, level):
+        image = cv2.pyrDown(self.pyramid(level - 1).image)
+        mask = None
+        if self.mask is not None:
+            mask = cv2.resize(self.mask, image.shape[::-1],
+                              interpolation=cv2.INTER_NEAREST)
+        return MatchingTemplate(image, mask)
+
+
+def as_matching_template(template, mask=None):
+    """Return template as a MatchingTemplate with mask, unless it already
+    is one"""
+    if isinstance(template, MatchingTemplate):
+        return template
+    return MatchingTemplate(template, mask)
+
+
+def get_keypoints(image, features, mask=None):
+    """Detect up to features ORB keypoints in image, only where mask is
+    not zero if given, and return their [x, y] coordinates and their
+    binary descriptors as arrays"""
+    orb = cv2.ORB_create(nfeatures=features)
+    keypoints, descriptors = orb.detectAndCompute(image, mask)
+    points = np.float32([keypoint.pt for keypoint in keypoints])
+    if descriptors is None:
+        descriptors = np.empty((0, orb.descriptorSize()), dtype=np.uint8)
+    return points.reshape(-1, 2), descriptors
+
+
+def get_spectrum(image, squared=False):
+    """Calculate the spectrum of image minus its mean, or of its squares if
+    squared is True, padded with zeros to an optimal size for the discrete
+    Fourier transform"""
+    height, width = image.shape
+    padded = np.zeros((cv2.getOptimalDFTSize(height),
+                       cv2.getOptimalDFTSize(width)), dtype=np.float32)
+    padded[:height, :width] = image
+    # removing the mean improves precision and does not change correlations
+    # against zero mean templates, nor variances of windows
+    padded[:height, :width] -= cv2.mean(image)[0]
+    if squared:
+        np.square(padded, out=padded)
+    return cv2.dft(padded, nonzeroRows=height)
+
+
+def get_kernel_spectrum(kernel, shape):
+    """Calculate the spectrum of kernel padded with zeros to shape"""
+    height, width = kernel.shape
+    padded = np.zeros(shape, dtype=np.float32)
+    padded[:height, :width] = kernel
+    return cv2.dft(padded, nonzeroRows=height)
+
+
+def correlate_spectra(spectrum, kernel_spectrum, rows, columns):
+    """Cross-correlate the image and the kernel whose spectra are given, and
+    return the rows by columns positions where kernel fits in the image"""
+    correlation = cv2.mulSpectrums(spectrum, kernel_spectrum, 0, conjB=True)
+    correlation = cv2.idft(correlation,
+                           flags=cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE,
+                           nonzeroRows=rows)
+    return correlation[:rows, :columns]
+
+
+def normalize_correlation(numerator, denominator):
+    """Divide correlations by their norms following OpenCV rules for windows
+    with little or no variance"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results = np.divide(numerator, denominator)
+    results[~(np.abs(results) < 1.125)] = 0
+    np.clip(results, -1, 1, out=results)
+    return results
+
+
+def get_window_norms(image, shape):
+    """Calculate, using integral images, the norm of every window of image
+    of shape minus its mean, for every position the window fits in"""
+    height, width = shape
+    sums, squares = cv2.integral2(image, sdepth=cv2.CV_64F,
+                                  sqdepth=cv2.CV_64F)
+
+    def windows(integral):
+        return (integral[height:, width:] - integral[:-height, width:]
+                - integral[height:, :-width] + integral[:-height, :-width])
+
+    sums = windows(sums)
+    variances = windows(squares)
+    variances -= sums * sums / (height * width)
+    np.maximum(variances, 0, out=variances)
+    return np.sqrt(variances).astype(np.float32)
+
+
+def match_template_fft(image, template):
+    """Match template against image as cv2.matchTemplate does using
+    TM_CCOEFF_NORMED, but correlating in the frequency domain. The spectrum
+    and the window norms of image are computed only once when image is a
+    MatchingImage, so many templates of the same size are matched with one
+    forward and one inverse transform each, or only an inverse transform
+    when template is a MatchingTemplate whose spectrum was already computed.
+    Returns locations to look for max values."""
+    if not isinstance(image, MatchingImage):
+        image = MatchingImage(image)
+    template = as_matching_template(template)
+    height, width = template.shape
+    spectrum = image.spectrum
+    rows = image.image.shape[0] - height + 1
+    columns = image.image.shape[1] - width + 1
+    if template.norm < np.finfo(np.float64).eps:
+        # flat templates match everywhere, as in OpenCV
+        return np.ones((rows, columns), dtype=np.float32)
+    correlation = correlate_spectra(spectrum,
+                                    template.spectrum(spectrum.shape), rows,
+                                    columns)
+    denominator = image.window_norms((height, width)) * np.float32(
+        template.norm)
+    return normalize_correlation(correlation, denominator)
+
+
+def match_template_masked_fft(image, template, mask=None):
+    """Match template against image applying mask to template as
+    cv2.matchTemplate does using TM_CCOEFF_NORMED, but correlating in the
+    frequency domain following Padfield's masked normalized
+    cross-correlation, so the cost does not depend on the size of template.
+    Non-zero values of mask are the pixels of template to match.
+    Returns locations to look for max values.
+
+    Ref: Dirk Padfield, Masked Object Registration in the Fourier Domain,
+    IEEE Transactions on Image Processing, Vol. 21, No. 5, May 2012"""
+    if not isinstance(image, MatchingImage):
+        image = MatchingImage(image)
+    template = as_matching_template(template, mask)
+    height, width = template.shape
+    rows = image.image.shape[0] - height + 1
+    columns = image.image.shape[1] - width + 1
+    count = template.weights.sum()
+    if not count:
+        return np.zeros((rows, columns), dtype=np.float32)
+    if template.norm < np.finfo(np.float64).eps:
+        return np.ones((rows, columns), dtype=np.float32)
+    shape = image.spectrum.shape
+    numerator = correlate_spectra(image.spectrum, template.spectrum(shape),
+                                  rows, columns)
+    weights_spectrum = template.spectrum(shape, weights=True)
+    sums = correlate_spectra(image.spectrum, weights_spectrum, rows, columns)
+    squares = correlate_spectra(image.squares_spectrum, weights_spectrum,
+                                rows, columns)
+    # variance of the masked windows times the number of masked pixels
+    squares -= sums * sums / count
+    np.maximum(squares, 0, out=squares)
+    denominator = np.sqrt(squares, out=squares)
+    denominator *= np.float32(template.norm)
+    return normalize_correlation(numerator, denominator)
+
+
+def get_window_score(window, template):
+    """Normalized correlation coefficient of the MatchingTemplate template
+    and a window of its same shape, only inside its mask if it has one, as
+    cv2.TM_CCOEFF_NORMED gives"""
+    weights = template.weights
+    count = weights.sum()
+    if not count:
+        return 0.0
+    window = window.astype(np.float32)
+    window -= (window * weights).sum() / count
+    window *= weights
+    norm = np.sqrt(np.square(window, dtype=np.float64).sum()) * template.norm
+    if not norm:
+        return 0.0
+    return float((window * template.zero_mean).sum() / norm)
+
+
+def match_template_chamfer(image, template):
+    """Match the Canny edges of template against the distance transform of
+    the Canny edges of image (ref: MatchingImage.distances), both
+    MatchingImage and MatchingTemplate objects, or arrays.
+    Every location scores 1 minus the mean distance at the template edge
+    points divided by CHAMFER_DISTANCE, so 1 means every template edge lies
+    on an image edge. The sums of distances of all locations are computed
+    at once correlating the distance transform with the template edges.
+    Locations are not rejected early: summing a few edge points everywhere
+    first, and the rest only where the threshold can still be reached, was
+    measured slower than this single correlation, up to 100 times.
+    Returns locations to look for max values."""
+    if not isinstance(image, MatchingImage):
+        image = MatchingImage(image)
+    template = as_matching_template(template)
+    kernel = template.edge_kernel
+    count = kernel.sum()
+    if not count:
+        height, width = image.image.shape[:2]
+        return np.zeros((height - template.shape[0] + 1,
+                         width - template.shape[1] + 1), dtype=np.float32)
+    sums = cv2.matchTemplate(image.distances, kernel, cv2.TM_CCORR)
+    return np.clip(1 - sums / (CHAMFER_DISTANCE * count), 0, 1)
+
+
+def get_similarity_transform(source, target):
+    """Return the 2x3 matrix of the rotation, uniform scale and translation
+    that best map the [x, y] points of source to those of target, in the
+    least squares sense"""
+    x, y = source[:, 0], source[:, 1]
+    ones, zeros = np.ones_like(x), np.zeros_like(x)
+    system = np.vstack([np.column_stack([x, -y, ones, zeros]),
+                        np.column_stack([y, x, zeros, ones])])
+    values = np.concatenate([target[:, 0], target[:, 1]])
+    (a, b, tx, ty), _, _, _ = np.linalg.lstsq(system.astype(np.float64),
+                                              values, rcond=None)
+    return np.float64([[a, -b, tx], [b, a, ty]])
+
+
+def get_similarity_inliers(source, target, seed=0):
+    """Find with RANSAC the largest group of matches between the [x, y]
+    points of source and those of target that agree, within
+    KEYPOINTS_REPROJECTION pixels, on a rotation, uniform scale and
+    translation. KEYPOINTS_HYPOTHESES transformations are computed from
+    random pairs of matches, drawn using seed so results are repeatable.
+    Returns a boolean array of the matches in the group"""
+    # points as complex numbers, so transformations are z * scale + shift
+    source = np.float64(source).dot([1, 1j])
+    target = np.float64(target).dot([1, 1j])
+    random = np.random.RandomState(seed)
+    first = random.randint(len(source), size=KEYPOINTS_HYPOTHESES)
+    second = random.randint(len(source), size=KEYPOINTS_HYPOTHESES)
+    distinct = source[first] != source[second]
+    first, second = first[distinct], second[distinct]
+    if not len(first):
+        return np.zeros(len(source), dtype=bool)
+    scales = ((target[second] - target[first])
+              / (source[second] - source[first]))
+    shifts = target[first] - scales * source[first]
+    inliers = np.abs(scales[:, None] * source + shifts[:, None]
+                     - target) <= KEYPOINTS_REPROJECTION
+    return inliers[inliers.sum(axis=1).argmax()]
+
+
+def get_keypoints_candidates(image, pairs, max_matches=None):
+    """Match every pair of template and flip (ref: get_templates_pairs())
+    against the MatchingImage image using their ORB keypoints, so templates
+    can be found rotated and rescaled. Descriptors of all the templates are
+    indexed together with locality-sensitive hashing, and the keypoints of
+    image are matched against all of them in one single query. For every
+    template, groups of at least KEYPOINTS_MIN_MATCHES matches agreeing on
+    a rotation, uniform scale and translation are then found with RANSAC
+    (ref: get_similarity_inliers()). The transformation that best fits
+    each group locates the match, and image is warped back onto the
+    template to score it by its normalized correlation coefficient.
+    Returns a list with the boxes as [x1, y1, x2, y2] of the candidates
+    scoring at least the threshold of the pair, their scores and their
+    template indices, in the order of pairs"""
+    empty = (np.empty((0, 4), dtype=int), np.empty(0, dtype=np.float32),
+             np.empty(0, dtype=int))
+    candidates = [empty] * len(pairs)
+    image_points, image_descriptors = image.keypoints
+    indexed = [position for position, (template, _, _, _) in enumerate(pairs)
+               if len(template.keypoints[1]) >= KEYPOINTS_MIN_MATCHES]
+    if not indexed or len(image_descriptors) < 2:
+        return candidates
+    matcher = cv2.FlannBasedMatcher(
+        dict(algorithm=6, table_number=6, key_size=12,  # FLANN_INDEX_LSH
+             multi_probe_level=1), dict(checks=50))
+    matcher.add([pairs[position][0].keypoints[1] for position in indexed])
+    matches = [match[0] for match in matcher.knnMatch(image_descriptors, k=2)
+               if len(match) == 2
+               and match[0].distance < KEYPOINTS_RATIO * match[1].distance]
+    height, width = image.image.shape[:2]
+    for collection_index, position in enumerate(indexed):
+        template, _, threshold, index = pairs[position]
+        template_matches = [match for match in matches
+                            if match.imgIdx == collection_index]
+        source = template.keypoints[0][
+            [match.trainIdx for match in template_matches]].reshape(-1, 2)
+        target = image_points[
+            [match.queryIdx for match in template_matches]].reshape(-1, 2)
+        template_height, template_width = template.shape
+        corners = np.float32([[0, 0], [template_width, 0],
+                              [template_width, template_height],
+                              [0, template_height]])
+        coords, probs = [], []
+        while len(source) >= KEYPOINTS_MIN_MATCHES:
+            inliers = get_similarity_inliers(source, target)
+            if inliers.sum() < KEYPOINTS_MIN_MATCHES:
+                break
+            transform = get_similarity_transform(source[inliers],
+                                                 target[inliers])
+            # refit to all the matches the least squares fit explains
+            errors = np.linalg.norm(cv2.transform(
+                source[None], transform)[0] - target, axis=1)
+            inliers |= errors <= KEYPOINTS_REPROJECTION
+            transform = get_similarity_transform(source[inliers],
+                                                 target[inliers])
+            source, target = source[~inliers], target[~inliers]
+            window = cv2.warpAffine(
+                image.image, transform, (template_width, template_height),
+                flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+            score = get_window_score(window, template)
+            if score < threshold:
+                continue
+            box = cv2.transform(corners[None], transform)[0]
+            x1, y1 = np.clip(np.floor(box.min(axis=0)), 0, (width, height))
+            x2, y2 = np.clip(np.ceil(box.max(axis=0)), 0, (width, height))
+            coords.append((x1, y1, x2, y2))
+            probs.append(score)
+        if probs:
+            coords = np.array(coords, dtype=int)
+            probs = np.array(probs, dtype=np.float32)
+            if max_matches is not None and len(probs) > max_matches:
+                best = select_best(probs, max_matches)
+                coords, probs = coords[best], probs[best]
+            candidates[position] = (coords, probs,
+                                    np.full(len(probs), index, dtype=int))
+    return candidates
+
+
+def get_edges_pair(image, template, method, sigma=0.33, level=0):
+    """Return the edge maps of the MatchingImage image and of the
+    MatchingTemplate template, with the eroded mask applied to the latter,
+    both downscaled level times by a factor of 2. Canny thresholds are set
+    from the median of the values of image and template together using
+    sigma"""
+    lower = upper = None
+    if method not in ('laplacian', 'sobel', 'scharr', 'prewitt', 'roberts'):
+        method = 'canny'
+        lower, upper = get_canny_thresholds(image.median(template), sigma)
+    return (image.edges(method, lower, upper, level),
+            template.edges(method, lower, upper, level))
+
+
 def match_template_mask(image, template, mask=None, method=None, sigma=0.33):
     """Match template against image applying mask to template using method.
     Method can be either of (None, 'laplacian', 'sobel', 'scharr', 'prewitt',
     'roberts', 'canny').
+    Image can also be a MatchingImage, and template a MatchingTemplate
+    (with its own mask), so their edge maps are reused across calls.
     Returns locations to look for max values."""
-    if mask is not None:
+    if not isinstance(image, MatchingImage):
+        image = MatchingImage(image)
+    template = as_matching_template(template, mask)
+    if template.mask is not None:
         if method:
-            kernel = np.ones((3, 3), np.uint8)
-            mask = cv2.erode(mask, kernel)
-            if method == 'laplacian':
-                # use CV_64F to not loose edges, convert to uint8 afterwards
-                edge_image = np.uint8(np.absolute(
-                    cv2.Laplacian(image, cv2.CV_64F)))
-                edge_template = np.uint8(np.absolute(
-                    cv2.Laplacian(template, cv2.CV_64F)
-                ))
-            elif method in ('sobel', 'scharr', 'prewitt', 'roberts'):
-                filter_func = getattr(skfilters, method)
-                edge_image = filter_func(image)
-                edge_template = filter_func(template)
-                edge_image = convert(edge_image)
-                edge_template = convert(edge_template)
-            else:  # method == 'canny'
-                values = np.hstack([image.ravel(), template.ravel()])
-                median = np.median(values)
-                lower = int(max(0, (1.0 - sigma) * median))
-                upper = int(min(255, (1.0 + sigma) * median))
-                edge_image = cv2.Canny(image, lower, upper)
-                edge_template = cv2.Canny(template, lower, upper)
-            results = cv2.matchTemplate(edge_image, edge_template & mask,
+            edge_image, edge_template = get_edges_pair(image, template,
+                                                       method, sigma)
+            results = cv2.matchTemplate(edge_image, edge_template,
                                         cv2.TM_CCOEFF_NORMED)
         else:
-            results = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED,
-                                        mask)
+            results = cv2.matchTemplate(image.image, template.image,
+                                        cv2.TM_CCOEFF_NORMED, template.mask)
     else:
-        results = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+        results = cv2.matchTemplate(image.image, template.image,
+                                    cv2.TM_CCOEFF_NORMED)
     return results
 
 
+def get_match_scores(image, template, mask=None, method=None,
+                     engine='opencv'):
+    """Match template against image applying mask to template using method
+    (ref: match_template_mask()). The 'fft' engine correlates templates
+    without mask, or with mask and no method, in the frequency domain
+    instead (ref: match_template_fft(), match_template_masked_fft()).
+    The 'chamfer' method, with or without mask, uses distance transforms
+    instead (ref: match_template_chamfer()).
+    Returns locations to look for max values."""
+    template = as_matching_template(template, mask)
+    if method == 'chamfer':
+        return match_template_chamfer(image, template)
+    elif engine == 'fft' and template.mask is None:
+        return match_template_fft(image, template)
+    elif engine == 'fft' and not method:
+        return match_template_masked_fft(image, template)
+    return match_template_mask(image, template, method=method)
+
+
+def get_match_candidates(results, threshold, shape, offset=(0, 0),
+                         peaks=False, max_matches=None):
+    """Return the boxes as [x1, y1, x2, y2] of the locations in results
+    scoring at least threshold for a template of shape, and their scores.
+    Offset is the (x, y) position of results in the image.
+    If peaks is True, only the local maxima of results in 3x3 neighborhoods
+    are returned. If max_matches is given, only the max_matches best
+    scoring local maxima are returned, since the best scoring locations
+    would otherwise all surround the same match."""
+    height, width = shape
+    index = results >= threshold
+    if peaks or max_matches is not None:
+        index &= results >= cv2.dilate(results, np.ones((3, 3), np.uint8))
+    y1, x1 = np.where(index)
+    probs = results[index]
+    if max_matches is not None and len(probs) > max_matches:
+        best = select_best(probs, max_matches)
+        y1, x1, probs = y1[best], x1[best], probs[best]
+    x1 += offset[0]
+    y1 += offset[1]
+    coords = np.array([x1, y1, x1 + width, y1 + height], dtype=int).T
+    return coords.reshape(-1, 4), probs
+
+
+def select_best(scores, count):
+    """Return the indices of the count best scores, in no particular order,
+    by partially sorting scores"""
+    if count <= 0:
+        return np.empty(0, dtype=int)
+    if count >= len(scores):
+        return np.arange(len(scores))
+    return np.argpartition(scores, len(scores) - count)[-count:]
+
+
+def match_template_pyramid(image, template, threshold, mask=None,
+                           method=None, engine='opencv', levels=1,
+                           peaks=False, max_matches=None):
+    """Match template against image coarse-to-fine. Template is first
+    matched against image downscaled levels times by a factor of 2, keeping
+    the locations that score at least threshold minus PYRAMID_RELAXATION.
+    Only small windows around them are then matched at full resolution.
+    Levels are reduced so the downscaled template is at least
+    PYRAMID_MIN_SIZE pixels wide and high.
+    Returns the boxes as [x1, y1, x2, y2] of the matches scoring at least
+    threshold, and their scores, optionally restricted to peaks and to the
+    max_matches best (ref: get_match_candidates())."""
+    if not isinstance(image, MatchingImage):
+        image = MatchingImage(image)
+    template = as_matching_template(template, mask)
+    height, width = template.shape
+    levels = max(0, min(levels, int(np.log2(
+        max(1, min(template.shape) / PYRAMID_MIN_SIZE)))))
+    coarse_template = template.pyramid(levels)
+    coarse_image = image.pyramid(levels)
+    if (levels <= 0 or any(np.greater(coarse_template.shape,
+                                      coarse_image.image.shape))):
+        results = get_match_scores(image, template, method=method,
+                                   engine=engine)
+        return get_match_candidates(results, threshold, template.shape,
+                                    peaks=peaks, max_matches=max_matches)
+    if template.mask is not None and method and method != 'chamfer':
+        # edges do not survive downscaling, so edge maps are computed at
+        # full resolution and then downscaled
+        coarse_results = cv2.matchTemplate(
+            *get_edges_pair(image, template, method, level=levels),
+            method=cv2.TM_CCOEFF_NORMED)
+    else:
+        coarse_results = get_match_scores(coarse_image, coarse_template,
+                                          method=method, engine=engine)
+    candidates = (coarse_results >= threshold - PYRAMID_RELAXATION)
+    # windows span one coarse location around every candidate
+    candidates = cv2.dilate(candidates.astype(np.uint8),
+                            np.ones((3, 3), np.uint8))
+    _, _, stats, _ = cv2.connectedComponentsWithStats(candidates)
+    factor = 2 ** levels
+    rows = image.image.shape[0] - height + 1
+    columns = image.image.shape[1] - width + 1
+    all_coords = [np.empty((0, 4), dtype=int)]
+    all_probs = [np.empty(0, dtype=np.float32)]
+    for left, top, box_width, box_height, _ in stats[1:]:
+        top, left = top * factor, left * factor
+        bottom = min(rows, (top + box_height * factor))
+        right = min(columns, (left + box_width * factor))
+        if top >= bottom or left >= right:
+            continue
+        window = image.crop(top, bottom + height - 1, left,
+                            right + width - 1)
+        results = get_match_scores(window, template, method=method,
+                                   engine=engine)
+        coords, probs = get_match_candidates(results, threshold,
+                                             template.shape, (left, top),
+                                             peaks, max_matches)
+        all_coords.append(coords)
+        all_probs.append(probs)
+    coords, probs = np.vstack(all_coords), np.concatenate(all_probs)
+    if max_matches is not None and len(probs) > max_matches:
+        best = select_best(probs, max_matches)
+        coords, probs = coords[best], probs[best]
+    return coords, probs
+
+
+def non_max_suppression(boxes, scores, overlap=0.15, labels=None):
+    """Greedy non-maximum suppression of boxes as [x1, y1, x2, y2] by their
+    scores, as imutils.object_detection.non_max_suppression does, removing
+    the boxes that overlap the best remaining box by more than overlap of
+    their area. If labels are given, only boxes with the same label
+    suppress each other. Returns the indices of the kept boxes by
+    decreasing score.
+    As in imutils, every kept box takes one step over the remaining boxes.
+    Computing the overlaps of all the boxes at once, in blocks, was found
+    slower for the clustered candidates of template matching, where few
+    boxes are kept and each step discards most of the remaining ones."""
+    if not len(boxes):
+        return np.empty(0, dtype=int)
+    boxes = boxes.astype(np.float64)
+    if labels is not None:
+        # shifting the boxes of each label apart by more than the extent of
+        # all the boxes handles every label in the same pass
+        boxes += (np.asarray(labels) * (boxes.max() + 2))[:, np.newaxis]
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = np.argsort(scores)
+    keep = []
+    while order.size:
+        best, order = order[-1], order[:-1]
+        keep.append(best)
+        width = np.minimum(x2[best], x2[order])
+        width -= np.maximum(x1[best], x1[order]) - 1
+        height = np.minimum(y2[best], y2[order])
+        height -= np.maximum(y1[best], y1[order]) - 1
+        np.maximum(width, 0, out=width)
+        np.maximum(height, 0, out=height)
+        order = order[width * height <= overlap * areas[order]]
+    return np.array(keep, dtype=int)
+
+
+def clip_threshold(threshold):
+    """Clip a matching threshold to the range 0 to 100, and scale it to the
+    range of the scores, 0 to 1"""
+    if threshold > 100:
+        threshold = 100
+    elif threshold < 0:
+        threshold = 0
+    return threshold / 100.0
+
+
+def get_templates_pairs(templates, threshold=None):
+    """Prepare the MatchingTemplate with mask, method, threshold, and index
+    of every template and flip in templates (ref: match_templates()).
+    Flips identical to another flip of the same template are skipped, since
+    they would only produce the same matches. Templates can also be a
+    TemplateBank, whose prepared templates are then used.
+    If threshold, from 0 to 1, is given, it is used for all the templates"""
+    if isinstance(templates, TemplateBank):
+        return [(template, method, template_threshold
+                 if threshold is None else threshold, index)
+                for template, method, template_threshold, index
+                in templates.pairs]
+    default_threshold = 80
+    pairs = []
+    for index, template in enumerate(templates):
+        template_threshold = threshold
+        if template_threshold is None:
+            template_threshold = clip_threshold(
+                template.get('threshold', default_threshold))
+        template_image = template.get('image')
+        template_flip = template.get('flip')
+        template_mask = template.get('mask')
+        template_method = template.get('method', 'canny')  # defaults to canny
+        gray_template = cv2.cvtColor(template_image, cv2.COLOR_BGR2GRAY)
+        flips = []
+        for transformation in get_flips(template_flip):
+            transformed = transformation(gray_template)
+            if template_mask is not None:
+                transformed_mask = transformation(template_mask)
+            else:
+                transformed_mask = None
+            if any(np.array_equal(transformed, flip.image)
+                   and np.array_equal(transformed_mask, flip.mask)
+                   for flip in flips):
+                continue
+            flips.append(MatchingTemplate(transformed, transformed_mask))
+            pairs.append((flips[-1], template_method, template_threshold,
+                          index))
+    return pairs
+
+
+class TemplateBank(object):
+    """Templates prepared for matching (ref: get_templates_pairs()) with
+    their features precomputed: histograms, edge maps for every method but
+    'canny', whose thresholds depend on the image, zero mean versions,
+    downscaled versions for pyramid levels, edge maps for the 'chamfer'
+    method, ORB keypoints for the 'orb' method, and, if the shape of the
+    images to match is known, spectra for the 'fft' engine (ref:
+    MatchingTemplate.prepare()).
+    Templates and flips that are near-duplicates of a previous one are
+    grouped, so the group is matched only once (ref:
+    group_duplicate_templates(), get_templates_candidates()).
+    A bank can be saved to a directory and loaded back with all the
+    features as memory-mapped NumPy arrays, so templates are never
+    prepared again"""
+    __slots__ = ('pairs', )
+    INDEX = 'bank.json'
+
+    def __init__(self, templates=(), pyramid=0, shape=None):
+        self.pairs = group_duplicate_templates(get_templates_pairs(templates))
+        dft_shape = None
+        if shape is not None:
+            dft_shape = tuple(cv2.getOptimalDFTSize(size)
+                              for size in shape[:2])
+        for template, method, _, _ in self.pairs:
+            levels = max(0, min(pyramid, int(np.log2(
+                max(1, min(template.shape) / PYRAMID_MIN_SIZE)))))
+            template.prepare(method, levels, dft_shape)
+
+    def __len__(self):
+        return len(set(index for _, _, _, index in self.pairs))
+
+    @property
+    def groups(self):
+        """Lists of the positions in pairs of the templates and flips
+        grouped as near-duplicates, in order of appearance"""
+        groups = collections.OrderedDict()
+        for position, (template, method, _, _) in enumerate(self.pairs):
+            representative = template.representative or template
+            groups.setdefault((id(representative), method),
+                              []).append(position)
+        return list(groups.values())
+
+    def save(self, path, overwrite=False):
+        """Save the bank to the directory path, creating it if needed.
+        An existing bank in path is only replaced if overwrite is True"""
+        if (not overwrite
+                and os.path.exists(os.path.join(path, self.INDEX))):
+            raise FileExistsError(
+                'A template bank already exists in {}'.format(path))
+        os.makedirs(path, exist_ok=True)
+        files = []
+
+        def store(array):
+            filename = '{:06d}.npy'.format(len(files))
+            np.save(os.path.join(path, filename), np.asarray(array))
+            files.append(filename)
+            return filename
+
+        def dump(template):
+            features = []
+            for key, value in template.export_features().items():
+                if isinstance(value, MatchingTemplate):
+                    features.append([key, dump(value)])
+                elif isinstance(value, tuple):
+                    features.append([key, [store(item) for item in value]])
+                else:
+                    features.append([key, store(value)])
+            return {
+                'image': store(template.image),
+                'mask': None if template.mask is None else store(
+                    template.mask),
+                'features': features,
+                'representative': None if template.representative is None
+                else positions[id(template.representative)][0],
+            }
+
+        # templates shared by several pairs are stored once
+        positions = collections.OrderedDict()
+        for template, _, _, _ in self.pairs:
+            positions.setdefault(id(template), (len(positions), template))
+        templates = [dump(template) for _, template in positions.values()]
+        pairs = [{
+            'template': positions[id(template)][0],
+            'method': method,
+            'threshold': threshold,
+            'index': template_index,
+        } for template, method, threshold, template_index in self.pairs]
+        with open(os.path.join(path, self.INDEX), 'w') as index_file:
+            json.dump({'templates': templates, 'pairs': pairs}, index_file,
+                      cls=JSONNumpyEncoder)
+
+    @classmethod
+    def load(cls, path):
+        """Load a bank saved in the directory path, memory-mapping all the
+        arrays"""
+
+        def load_array(filename):
+            array = np.load(os.path.join(path, filename), mmap_mode='r')
+            return array[()] if array.ndim == 0 else array
+
+        def as_key(value):
+            if isinstance(value, list):
+                return tuple(as_key(item) for item in value)
+            return value
+
+        def load_template(entry):
+            mask = None
+            if entry['mask'] is not None:
+                mask = load_array(entry['mask'])
+            template = MatchingTemplate(load_array(entry['image']), mask)
+            features = {}
+            for key, value in entry['features']:
+                if isinstance(value, dict):
+                    value = load_template(value)
+                elif isinstance(value, list):
+                    value = tuple(load_array(item) for item in value)
+                else:
+                    value = load_array(value)
+                features[as_key(key)] = value
+            template.import_features(features)
+            return template
+
+        with open(os.path.join(path, cls.INDEX)) as index_file:
+            index = json.load(index_file)
+        templates = [load_template(entry) for entry in index['templates']]
+        for template, entry in zip(templates, index['templates']):
+            if entry['representative'] is not None:
+                template.representative = templates[entry['representative']]
+        bank = cls()
+        bank.pairs = [(templates[entry['template']], entry['method'],
+                       entry['threshold'], entry['index'])
+                      for entry in index['pairs']]
+        return bank
+
+
+def group_duplicate_templates(pairs):
+    """Group every pair of template and flip (ref: get_templates_pairs())
+    whose template is a near-duplicate of the template of a previous pair,
+    with the same method other than 'orb', shape and mask, and a normalized
+    correlation coefficient of at least DUPLICATE_TEMPLATE_SCORE, by setting
+    that template as its representative. Returns pairs"""
+    representatives = []
+    for template, method, _, _ in pairs:
+        if method == 'orb':
+            continue
+        for representative, representative_method in representatives:
+            if (method == representative_method
+                    and template.shape == representative.shape
+                    and np.array_equal(template.mask, representative.mask)
+                    and get_window_score(template.image, representative)
+                    >= DUPLICATE_TEMPLATE_SCORE):
+                template.representative = representative
+                break
+        else:
+            representatives.append((template, method))
+    return pairs
+
+
+def get_duplicate_threshold(threshold):
+    """Return the score a template needs at a location so that a
+    near-duplicate of it (ref: group_duplicate_templates()) can score at
+    least threshold there. The angles between windows and templates whose
+    cosines are their normalized correlation coefficients add at most, so
+    no location is missed for the intensity correlation of templates"""
+    angle = (np.arccos(np.clip(threshold, -1, 1))
+             + np.arccos(DUPLICATE_TEMPLATE_SCORE))
+    return float(np.cos(min(angle, np.pi)))
+
+
+def get_boxes_scores(image, template, coords, method=None):
+    """Match template using method (ref: get_match_scores()) only at the
+    boxes as [x1, y1, x2, y2] coords of the MatchingImage image, and
+    return their scores"""
+    return np.array([
+        get_match_scores(image.crop(y1, y2, x1, x2), template,
+                         method=method)[0, 0]
+        for x1, y1, x2, y2 in coords], dtype=np.float32)
+
+
+def get_templates_candidates(image, pairs, workers=1, engine='opencv',
+                             pyramid=0, peaks=False, max_matches=None,
+                             regions=None, tile_size=None):
+    """Match every pair of template and flip (ref: get_templates_pairs())
+    against the MatchingImage image, optionally using a pool of workers
+    threads, and return the boxes as [x1, y1, x2, y2] of the candidates,
+    their scores and their template indices, in the order of pairs.
+    Pairs sharing the same MatchingTemplate and method are matched only
+    once with their lowest threshold. Near-duplicates grouped by a
+    TemplateBank are matched through their representative with a lower
+    threshold (ref: get_duplicate_threshold()), and then scored with their
+    own template only at its candidates.
+    If regions is given, only those regions of image are searched, and if
+    tile_size is given, image is searched tile by tile (ref:
+    get_regions_candidates())"""
+    if regions is not None or tile_size is not None:
+        return get_regions_candidates(image, pairs, regions, workers, engine,
+                                      pyramid, peaks, max_matches, tile_size)
+    shared = collections.OrderedDict()
+    for template, method, threshold, index in pairs:
+        representative = template.representative or template
+        if representative is not template:
+            threshold = get_duplicate_threshold(threshold)
+        key = (id(representative), method)
+        if key not in shared or threshold < shared[key][2]:
+            shared[key] = (representative, method, threshold, index)
+    shared_pairs = list(shared.values())
+
+    keypoints_pairs = [pair for pair in shared_pairs if pair[1] == 'orb']
+    keypoints_candidates = dict(zip(
+        map(id, keypoints_pairs),
+        get_keypoints_candidates(image, keypoints_pairs, max_matches)))
+
+    def match_pair(pair):
+        template, method, threshold, index = pair
+        if method == 'orb':
+            return keypoints_candidates[id(pair)][:2]
+        elif pyramid:
+            coords, probs = match_template_pyramid(
+                image, template, threshold, method=method, engine=engine,
+                levels=pyramid, peaks=peaks, max_matches=max_matches)
+        else:
+            results = get_match_scores(image, template, method=method,
+                                       engine=engine)
+            coords, probs = get_match_candidates(
+                results, threshold, template.shape, peaks=peaks,
+                max_matches=max_matches)
+        return coords, probs
+
+    if workers > 1 and len(shared_pairs) > 1:
+        # OpenCV releases the GIL while matching, and map keeps the order
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            scores = list(executor.map(match_pair, shared_pairs))
+    else:
+        scores = [match_pair(pair) for pair in shared_pairs]
+    scores = dict(zip(shared.keys(), scores))
+    candidates = []
+    for template, method, threshold, index in pairs:
+        representative = template.representative or template
+        coords, probs = scores[(id(representative), method)]
+        if representative is not template:
+            probs = get_boxes_scores(image, template, coords, method)
+        kept = probs >= threshold
+        candidates.append((coords[kept], probs[kept],
+                           np.full(kept.sum(), index, dtype=int)))
+    return tuple(np.concatenate(arrays) for arrays in zip(
+        (np.empty((0, 4), dtype=int), np.empty(0, dtype=np.float32),
+         np.empty(0, dtype=int)), *candidates))
+
+
+def get_region_polygon(region):
+    """Turn a region, either a polygon as a list of [x, y] points or a
+    rectangle as its [[x1, y1], [x2, y2]] corners, into a polygon"""
+    points = np.int32(region).reshape(-1, 2)
+    if len(points) == 2:
+        (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+        points = np.int32([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+    return points
+
+
+def get_regions_candidates(image, pairs, regions=None, workers=1,
+                           engine='opencv', pyramid=0, peaks=False,
+                           max_matches=None, tile_size=None):
+    """Match every pair of template and flip (ref: get_templates_pairs())
+    only inside regions of the MatchingImage image, each region being a
+    polygon or a rectangle (ref: get_region_polygon()), or inside the whole
+    image if no regions are given.
+    Every region is searched in a crop of its bounding box padded by the
+    size of the largest template, and only the candidates whose center
+    lies inside the region are kept, with their boxes mapped back to image.
+    If tile_size is given, regions are split into tiles of up to tile_size
+    by tile_size pixels searched one at a time, each one padded the same
+    way, so score maps are never larger than a padded tile.
+    Returns the boxes, scores and template indices of the candidates as
+    get_templates_candidates() does"""
+    height, width = image.image.shape[:2]
+    if regions is None:
+        regions = [[[0, 0], [width - 1, height - 1]]]
+    padding = REGION_MARGIN + max(
+        (max(template.shape) for template, _, _, _ in pairs), default=0)
+    all_candidates = [(np.empty((0, 4), dtype=int),
+                       np.empty(0, dtype=np.float32),
+                       np.empty(0, dtype=int))]
+    for region in regions:
+        polygon = get_region_polygon(region)
+        x1, y1 = polygon.min(axis=0)
+        x2, y2 = polygon.max(axis=0)
+        region_mask = get_mask_polygons([polygon - (x1, y1)],
+                                        y2 - y1 + 1, x2 - x1 + 1)
+        step = tile_size or max(x2 - x1, y2 - y1) + 1
+        for tile_y1 in range(y1, y2 + 1, step):
+            for tile_x1 in range(x1, x2 + 1, step):
+                tile_y2 = min(y2, tile_y1 + step - 1)
+                tile_x2 = min(x2, tile_x1 + step - 1)
+                top, left = (max(0, tile_y1 - padding),
+                             max(0, tile_x1 - padding))
+                bottom = min(height, tile_y2 + padding + 1)
+                right = min(width, tile_x2 + padding + 1)
+                if top >= bottom or left >= right:
+                    continue
+                crop = image.crop(top, bottom, left, right, edges=False)
+                coords, probs, indices = get_templates_candidates(
+                    crop, pairs, workers, engine, pyramid, peaks,
+                    max_matches)
+                coords += (left, top, left, top)
+                # keep the candidates centered in the tile and the region
+                centers_x = (coords[:, 0] + coords[:, 2]) // 2
+                centers_y = (coords[:, 1] + coords[:, 3]) // 2
+                inside = ((centers_x >= tile_x1) & (centers_x <= tile_x2)
+                          & (centers_y >= tile_y1) & (centers_y <= tile_y2))
+                inside[inside] = region_mask[centers_y[inside] - y1,
+                                             centers_x[inside] - x1] > 0
+                all_candidates.append((coords[inside], probs[inside],
+                                       indices[inside]))
+    coords, probs, indices = (np.concatenate(arrays)
+                              for arrays in zip(*all_candidates))
+    if not len(probs):
+        # np.unique() cannot handle empty arrays with axis in numpy < 1.15
+        return coords, probs, indices
+    # boxes found more than once, by overlapping regions or by several
+    # flips of a template, are only kept once with their best score
+    order = np.argsort(-probs, kind='mergesort')
+    _, unique = np.unique(np.column_stack([coords, indices])[order], axis=0,
+                          return_index=True)
+    unique = np.sort(order[unique])
+    return coords[unique], probs[unique], indices[unique]
+
+
+def map_completed(func, iterable, workers=1):
+    """Apply func to every item of iterable using a pool of workers
+    threads, and yield the position of every item and its result as soon
+    as it completes. Items are only taken from iterable when a worker is
+    about to be free, so iterable can be a generator of large items"""
+    if workers <= 1:
+        for position, item in enumerate(iterable):
+            yield position, func(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for position, item in enumerate(iterable):
+            if len(pending) >= workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+            pending[executor.submit(func, item)] = position
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+def suppress_matches(coords, probs, indices, overlap=0.15,
+                     suppression='template', max_matches=None):
+    """Suppress overlapping candidates either among those of the same
+    template index ('template') or among all of them ('global'), and
+    return the indices of the kept ones sorted by template index and
+    decreasing score, keeping at most max_matches per template"""
+    labels = indices if suppression == 'template' else None
+    keep = non_max_suppression(coords, probs, overlap, labels)
+    # sort by template, keeping the decreasing score order of suppression
+    keep = keep[np.argsort(indices[keep], kind='mergesort')]
+    if max_matches is not None:
+        # rank of every match among the matches of its template
+        ranks = np.arange(len(keep)) - np.searchsorted(indices[keep],
+                                                       indices[keep])
+        keep = keep[ranks < max_matches]
+    return keep
+
+
+def guided_filter(image, radius, eps, guide=None):
+    """Edge-preserving smoothing of image using guide as the guidance image,
+    after He et al. (2013) "Guided Image Filtering", IEEE Transactions on
+    Pattern Analysis and Machine Intelligence, 35(6): 1397-1409.
+    Since it only relies on box filters, its cost does not depend on radius.
+    If guide is not given, image guides itself. Color channels are filtered
+    independently and eps, the regularization term, is expressed in squared
+    intensity units. It is raised to 1 if lower, so flat regions are kept
+    instead of dividing by their zero variance."""
+    if radius < 1:
+        return image.copy()
+    eps = max(eps, 1)
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    source = image.astype(np.float32)
+    if guide is None:
+        guide = source
+    else:
+        guide = guide.astype(np.float32)
+    mean_guide = cv2.boxFilter(guide, -1, ksize)
+    mean_source = cv2.boxFilter(source, -1, ksize)
+    covariance = cv2.boxFilter(guide * source, -1, ksize)
+    covariance -= mean_guide * mean_source
+    variance = cv2.boxFilter(guide * guide, -1, ksize)
+    variance -= mean_guide * mean_guide
+    # a = covariance / (variance + eps), b = mean_source - a * mean_guide
+    a = covariance
+    a /= variance + eps
+    b = mean_source
+    b -= a * mean_guide
+    output = cv2.boxFilter(a, -1, ksize)
+    output *= guide
+    output += cv2.boxFilter(b, -1, ksize)
+    return np.clip(np.rint(output), 0, 255).astype(np.uint8)
+
+
+def estimate_noise(image, sample_size=512):
+    """Estimate the standard deviation of the noise of image from a centered
+    sample of at most sample_size by sample_size pixels, using the method
+    described in Immerkaer J. (1996) "Fast Noise Variance Estimation",
+    Computer Vision and Image Understanding, 64(2): 300-302."""
+    height, width = image.shape[:2]
+    top = max(0, (height - sample_size) // 2)
+    left = max(0, (width - sample_size) // 2)
+    sample = image[top:top + sample_size, left:left + sample_size]
+    if min(sample.shape[:2]) < 3:
+        return 0.0
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], np.float32)
+    laplacian = cv2.filter2D(sample.astype(np.float32), -1, kernel)
+    laplacian = np.absolute(laplacian[1:-1, 1:-1])
+    return float(np.sqrt(np.pi / 2) * laplacian.sum() / (6 * laplacian.size))
+
+
+def non_local_means(image, strength, luma=False, windows=(7, 21)):
+    """Denoise a color image using non-local means with strength as the filter
+    strength and windows as the size of the template and search windows.
+    If luma is True, only the luma channel is denoised and chroma is kept."""
+    template_window, search_window = windows
+    if luma:
+        ycrcb = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
+        ycrcb[:, :, 0] = cv2.fastNlMeansDenoising(
+            ycrcb[:, :, 0], None, strength, template_window, search_window)
+        return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
+    return cv2.fastNlMeansDenoisingColored(image, None, strength, strength,
+                                           template_window, search_window)
+
+
 def parse_colors(ctx, param, value):
     """Callback to parse color values from a JSON list or hexadecimal string
     to a RGB tuple.
@@ -598,6 +2053,213 @@ def convert(image):
         return minmax_scale(image, (0, 255)).astype(np.ubyte)
 
 
+def to_gray_uint8(image):
+    """Return image as a gray-scale 8 bits image. Color images are converted
+    from BGR, and images of other types are scaled to the range 0 to 255"""
+    if image.dtype != np.uint8:
+        image = cv2.normalize(image.astype(np.float32), None, 0, 255,
+                              cv2.NORM_MINMAX, cv2.CV_8U)
+    if image.ndim != 2:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def get_gray_histogram(image, band_size=2 ** 22):
+    """Calculate the 256 bins histogram of a gray-scale 8 bits image. Pixels
+    are counted in bands of at most band_size pixels to bound memory usage"""
+    histogram = np.zeros(256, dtype=np.int64)
+    rows = max(1, band_size // max(1, image.shape[1]))
+    for top in range(0, image.shape[0], rows):
+        band = np.ascontiguousarray(image[top:top + rows])
+        histogram += np.bincount(band.ravel(), minlength=256)
+    return histogram
+
+
+def otsu_threshold(counts, values):
+    """Otsu's threshold of a histogram of counts for values"""
+    weight1 = np.cumsum(counts)
+    weight2 = np.cumsum(counts[::-1])[::-1]
+    mean1 = np.cumsum(counts * values) / weight1
+    mean2 = (np.cumsum((counts * values)[::-1]) / weight2[::-1])[::-1]
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+    return values[:-1][np.argmax(variance12)]
+
+
+def isodata_threshold(counts, values):
+    """Ridler-Calvard's (isodata) threshold of a histogram of counts for
+    values"""
+    csuml = np.cumsum(counts)
+    csumh = np.cumsum(counts[::-1])[::-1] - counts
+    csum_intensity = np.cumsum(counts * values)
+    lower = csum_intensity[:-1] / csuml[:-1]
+    higher = (csum_intensity[-1] - csum_intensity[:-1]) / csumh[:-1]
+    distances = (lower + higher) / 2.0 - values[:-1]
+    bin_width = values[1] - values[0]
+    return values[:-1][(distances >= 0) & (distances < bin_width)][0]
+
+
+def li_threshold(counts, values):
+    """Li's iterative minimum cross entropy threshold of a histogram of counts
+    for values, which are expected to be consecutive integers"""
+    minimum = values[0]
+    shifted = values - minimum  # log(mean) requires positive values
+    tolerance = 0.5 * shifted[-1] / 256
+    csum_counts = np.cumsum(counts)
+    csum_intensity = np.cumsum(counts * shifted)
+    total_counts = csum_counts[-1]
+    total_intensity = csum_intensity[-1]
+    new_threshold = total_intensity / total_counts
+    old_threshold = new_threshold + 2 * tolerance
+    threshold = new_threshold
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while abs(new_threshold - old_threshold) > tolerance:
+            old_threshold = new_threshold
+            threshold = old_threshold + tolerance
+            index = int(np.clip(np.floor(threshold), 0, shifted[-1]))
+            mean_back = csum_intensity[index] / csum_counts[index]
+            mean_obj = ((total_intensity - csum_intensity[index])
+                        / (total_counts - csum_counts[index]))
+            temp = ((mean_back - mean_obj)
+                    / (np.log(mean_back) - np.log(mean_obj)))
+            if temp < 0:
+                new_threshold = temp - tolerance
+            else:
+                new_threshold = temp + tolerance
+    return threshold + minimum
+
+
+def histogram_thresholds(histogram, methods=('isodata', 'li', 'otsu')):
+    """Calculate the thresholds for methods ('isodata', 'li', 'otsu') from
+    a 256 bins histogram of a gray-scale image in a single pass over
+    histogram, following the implementations in scikit-image.
+    Returns a dictionary with methods as keys and thresholds as values."""
+    histogram = np.asarray(histogram)
+    nonzero = np.flatnonzero(histogram)
+    # only the range of values present in the image is considered
+    low, high = nonzero[0], nonzero[-1]
+    counts = histogram[low:high + 1].astype(np.float64)
+    values = np.arange(low, high + 1, dtype=np.float64)
+    funcs = {
+        'isodata': isodata_threshold,
+        'li': li_threshold,
+        'otsu': otsu_threshold,
+    }
+    thresholds = {}
+    for method in methods:
+        if low == high:
+            thresholds[method] = float(low)
+        else:
+            thresholds[method] = float(funcs[method](counts, values))
+    return thresholds
+
+
+def sauvola_binarize(image, window_size=15, k=0.2, r=None,
+                     band_size=2 ** 20):
+    """Binarize a gray-scale 8 bits image using Sauvola's local thresholding,
+    turning into white the pixels lower or equal than the threshold of their
+    window_size by window_size neighborhood. It is equivalent to scikit-image
+    threshold_sauvola, but the local means and variances are computed from
+    int64 integral images of bands of band_size pixels (plus a halo of half a
+    window), and the result is written directly to the 8 bits output, so
+    memory usage is bounded.
+    For reference
+    Sauvola J. and Pietikainen M. (2000) "Adaptive document image
+    binarization" Pattern Recognition, 33(2): 225-236"""
+    if window_size % 2 == 0:
+        raise ValueError('Window size must be odd')
+    if r is None:
+        r = 0.5 * 255  # half of the dynamic range of 8 bits images
+    height, width = image.shape
+    half = window_size // 2
+    area = window_size * window_size
+    rows = max(window_size, band_size // max(1, width))
+    output = np.empty((height, width), dtype=np.uint8)
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        # halo rows are reflected at the edges of the image as in np.pad
+        indices = np.abs(np.arange(top - half, bottom + half))
+        indices = (height - 1) - np.abs((height - 1) - indices)
+        band = cv2.copyMakeBorder(image[np.clip(indices, 0, height - 1)],
+                                  0, 0, half, half, cv2.BORDER_REFLECT_101)
+        band = band.astype(np.int64)
+        integral = np.zeros((band.shape[0] + 1, band.shape[1] + 1), np.int64)
+        np.cumsum(band, axis=0, out=integral[1:, 1:])
+        np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+        sums = (integral[window_size:, window_size:]
+                - integral[:-window_size, window_size:]
+                - integral[window_size:, :-window_size]
+                + integral[:-window_size, :-window_size])
+        band *= band
+        np.cumsum(band, axis=0, out=integral[1:, 1:])
+        np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+        squared_sums = (integral[window_size:, window_size:]
+                        - integral[:-window_size, window_size:]
+                        - integral[window_size:, :-window_size]
+                        + integral[:-window_size, :-window_size])
+        mean = sums / area
+        deviation = squared_sums / area
+        deviation -= mean * mean
+        np.clip(deviation, 0, None, out=deviation)
+        np.sqrt(deviation, out=deviation)
+        threshold = mean
+        threshold *= 1 + k * ((deviation / r) - 1)
+        np.multiply(image[top:bottom] <= threshold, 255,
+                    out=output[top:bottom], casting='unsafe')
+    return output
+
+
+def gaussian_kernel(sigma, truncate=4.0):
+    """Return the normalized float32 1D Gaussian kernel of standard deviation
+    sigma, truncated at truncate standard deviations as in SciPy"""
+    radius = int(truncate * sigma + 0.5)
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def ridges_downsampling(sigma):
+    """Return the integer factor an image can be downsampled by to detect
+    ridges at scale sigma, so the sigma at the coarse scale is at most
+    COARSE_RIDGES_SIGMA"""
+    return max(1, int(np.ceil(sigma / COARSE_RIDGES_SIGMA)))
+
+
+def hessian_ridges(image, sigma, band_size=2 ** 20):
+    """Calculate the largest eigenvalue of the Hessian matrix of a gray-scale
+    8 bits image at scale sigma, as scikit-image hessian_matrix and
+    hessian_matrix_eigvals would do on the Gaussian smoothed image (with
+    zeros beyond the borders and central differences). It is computed in
+    float32 for bands of band_size pixels plus a halo of the kernel radius,
+    using separable filtering and the closed form of the eigenvalues of a
+    2x2 symmetric matrix, so memory usage is bounded."""
+    height, width = image.shape
+    kernel = gaussian_kernel(sigma)
+    # central differences of central differences need 2 more rows
+    halo = kernel.size // 2 + 2
+    rows = max(1, band_size // max(1, width))
+    eigenvalues = np.empty((height, width), dtype=np.float32)
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        start, end = max(top - halo, 0), min(bottom + halo, height)
+        smoothed = cv2.sepFilter2D(image[start:end], cv2.CV_32F, kernel,
+                                   kernel, borderType=cv2.BORDER_CONSTANT)
+        # only keep the rows the differences can reach
+        low, high = max(top - 2, 0), min(bottom + 2, height)
+        smoothed = smoothed[low - start:high - start]
+        gradient_y = np.gradient(smoothed, axis=0)
+        gradient_x = np.gradient(smoothed, axis=1)
+        hyy = np.gradient(gradient_y, axis=0)
+        hxy = np.gradient(gradient_y, axis=1)
+        hxx = np.gradient(gradient_x, axis=1)
+        band = slice(top - low, bottom - low)
+        hxx, hxy, hyy = hxx[band], hxy[band], hyy[band]
+        # largest eigenvalue is (hxx + hyy) / 2 + sqrt(((hxx - hyy) / 2)^2
+        # + hxy^2)
+        largest = eigenvalues[top:bottom]
+        cv2.magnitude(0.5 * (hxx - hyy), hxy, largest)
+        largest += 0.5 * (hxx + hyy)
+    return eigenvalues
+
+
 def parse_histogram(histogram):
     """Parse a dictionary or JSON string representing a histogram of colors
     by parsing the keys that codify colors into lists of RGB components
@@ -8,6 +8,7 @@ test_api
 Tests for `histonets_cv.api` module.
 """
 import os
+import sys
 import unittest
 
 import cv2
@@ -75,6 +76,24 @@ class TestHistonets(unittest.TestCase):
             histonets.adjust_brightness(image, 200)
         )
 
+    def test_adjust_point_operations(self):
+        image = self.image
+        operations = [
+            histonets.brightness_operation(150),
+            histonets.contrast_operation(150),
+        ]
+        fused = histonets.adjust_point_operations(image, operations)
+        chained = histonets.adjust_contrast(
+            histonets.adjust_brightness(image, 150), 150)
+        assert np.array_equal(fused, chained)
+
+    def test_adjust_point_operations_empty(self):
+        image = self.image
+        assert np.array_equal(
+            histonets.adjust_point_operations(image, []),
+            image
+        )
+
     def test_smooth_image(self):
         image = self.image
         smooth_image = histonets.smooth_image(image, 50)
@@ -94,6 +113,27 @@ class TestHistonets(unittest.TestCase):
             test_smooth0_image
             )
 
+    def test_smooth_image_guided(self):
+        image = self.image
+        smooth_image = histonets.smooth_image(image, 50, method='guided')
+        test_smooth_image = cv2.imread(fixtures_path('smooth50.png'))
+        assert smooth_image.shape == image.shape
+        assert smooth_image.dtype == np.uint8
+        assert not np.array_equal(smooth_image, image)
+        # approximation of the bilateral filter within a few intensity values
+        assert np.abs(smooth_image.astype(int) - test_smooth_image).mean() < 5
+
+    def test_smooth_image_guided_value_parsing(self):
+        image = self.image
+        assert np.array_equal(
+            histonets.smooth_image(image, -50, method='guided'),
+            image
+        )
+        assert np.array_equal(
+            histonets.smooth_image(image, 150, method='guided'),
+            histonets.smooth_image(image, 100, method='guided')
+        )
+
     def test_histogram_equalization(self):
         image = self.image
         test_hist_eq = cv2.imread(fixtures_path('test_hist_eq5.png'))
@@ -115,6 +155,23 @@ class TestHistonets(unittest.TestCase):
             test_hist_eq10
         )
 
+    def test_histogram_equalization_keeps_input(self):
+        image = self.image
+        original = image.copy()
+        equalized = histonets.histogram_equalization(image, 50)
+        assert equalized.dtype == np.uint8
+        assert np.array_equal(image, original)
+        assert np.array_equal(
+            equalized,
+            histonets.histogram_equalization(image, 50)
+        )
+
+    def test_histogram_equalization_stretch(self):
+        image = (self.image // 4 + 40).astype(np.uint8)
+        equalized = histonets.histogram_equalization(image, 0)
+        assert equalized.min() == 0
+        assert equalized.max() == 255
+
     def test_denoise_image(self):
         image = self.image
         test_denoise_img = cv2.imread(fixtures_path('denoised10.png'))
@@ -136,6 +193,55 @@ class TestHistonets(unittest.TestCase):
             test_denoise_img100
         )
 
+    def test_denoise_image_auto(self):
+        image = self.image
+        value = utils.estimate_noise(image)
+        assert np.array_equal(
+            histonets.denoise_image(image, 100, auto=True),
+            histonets.denoise_image(image, value)
+        )
+
+    def test_denoise_image_luma(self):
+        image = self.image
+        denoised = histonets.denoise_image(image, 10, luma=True)
+        ycrcb = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb).astype(int)
+        denoised_ycrcb = cv2.cvtColor(denoised, cv2.COLOR_BGR2YCrCb)
+        # chroma is kept up to color conversion rounding errors
+        assert np.abs(ycrcb - denoised_ycrcb)[:, :, 1:].mean() < 1
+        assert not np.array_equal(denoised, image)
+
+    def test_denoise_image_fast(self):
+        image = self.image
+        denoised = histonets.denoise_image(image, 10, fast=True)
+        assert denoised.shape == image.shape
+        assert not np.array_equal(denoised, histonets.denoise_image(image, 10))
+
+    def test_denoise_image_scale(self):
+        image = self.image
+        noise = np.random.RandomState(0).normal(0, 15, image.shape)
+        noisy = np.clip(image + noise, 0, 255).astype(np.uint8)
+        denoised = histonets.denoise_image(noisy, 15, scale=50)
+        assert denoised.shape == image.shape
+        assert cv2.PSNR(denoised, image) > cv2.PSNR(noisy, image)
+
+    def test_denoise_image_scale_flat(self):
+        image = np.full((64, 48, 3), 120, dtype=np.uint8)
+        assert np.array_equal(histonets.denoise_image(image, 0, scale=50),
+                              image)
+        assert np.array_equal(
+            histonets.denoise_image(image, 10, auto=True, scale=50), image)
+
+    def test_denoise_image_scale_value_parsing(self):
+        image = self.image
+        assert np.array_equal(
+            histonets.denoise_image(image, 10, scale=110),
+            histonets.denoise_image(image, 10)
+        )
+        assert np.array_equal(
+            histonets.denoise_image(image, 10, scale=-10),
+            histonets.denoise_image(image, 10, scale=1)
+        )
+
     def test_posterization_linear_4_colors(self):
         image = self.image
         test_image = cv2.imread(fixtures_path('poster_linear4.png'))
@@ -452,6 +558,272 @@ class TestHistonets(unittest.TestCase):
         matches = histonets.match_templates(image, templates)
         assert np.array_equal(test_matches, matches)
 
+    def test_match_templates_workers(self):
+        image = self.image
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 95, 'flip': 'a'},
+            {'image': cv2.imread(fixtures_path('template_h.png')),
+             'threshold': 90, 'flip': 'h'},
+        ]
+        matches = histonets.match_templates(image, templates)
+        assert len(matches) > 1
+        for workers in (2, 8):
+            assert np.array_equal(
+                matches,
+                histonets.match_templates(image, templates, workers=workers)
+            )
+
+    def test_match_templates_fft(self):
+        image = self.image
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 95, 'flip': 'a'},
+            {'image': cv2.imread(fixtures_path('template_v.png')),
+             'threshold': 90},
+        ]
+        assert np.array_equal(
+            histonets.match_templates(image, templates),
+            histonets.match_templates(image, templates, engine='fft')
+        )
+
+    def test_match_templates_fft_mask(self):
+        image = self.image
+        template = cv2.imread(fixtures_path('template_m.png'))
+        polygon = [[50, 50], [120, 50], [120, 82], [50, 82]]
+        mask = utils.get_mask_polygons([polygon], *template.shape[:2])
+        templates = [{
+            'image': template,
+            'threshold': 45,
+            'mask': mask,
+            'method': None,
+        }]
+        test_matches = [[[209, 299], [379, 431]]]
+        matches = histonets.match_templates(image, templates, engine='fft')
+        assert np.array_equal(test_matches, matches)
+
+    def test_match_templates_pyramid(self):
+        image = self.image
+        template = cv2.imread(fixtures_path('template_m.png'))
+        polygon = [[50, 50], [120, 50], [120, 82], [50, 82]]
+        mask = utils.get_mask_polygons([polygon], *template.shape[:2])
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 80, 'flip': 'a'},
+            {'image': template, 'threshold': 45, 'mask': mask},
+        ]
+        matches = histonets.match_templates(image, templates)
+        for pyramid in (1, 2):
+            assert np.array_equal(
+                matches,
+                histonets.match_templates(image, templates, pyramid=pyramid)
+            )
+
+    def test_match_templates_suppression(self):
+        image = self.image
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 95},
+            {'image': cv2.imread(fixtures_path('template_h.png')),
+             'threshold': 80, 'flip': 'h'},
+        ]
+        matches, scores, indices = histonets.match_templates(
+            image, templates, return_scores=True)
+        assert matches.tolist() == [[[259, 349], [329, 381]]] * 2
+        assert indices.tolist() == [0, 1]
+        assert (scores >= 0.95).all()
+        matches, scores, indices = histonets.match_templates(
+            image, templates, suppression='global', return_scores=True)
+        assert matches.tolist() == [[[259, 349], [329, 381]]]
+        assert len(scores) == len(indices) == 1
+
+    def test_match_templates_regions(self):
+        image = self.image
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 95},
+            {'image': cv2.imread(fixtures_path('template_m.png')),
+             'threshold': 45, 'method': 'laplacian',
+             'mask': np.full((132, 170), 255, dtype=np.uint8)},
+        ]
+        matches = histonets.match_templates(image, templates)
+        rectangle = [[250, 340], [340, 390]]
+        polygon = [[290, 360], [300, 360], [300, 370], [290, 370]]
+        for regions in ([rectangle], [polygon], [rectangle, polygon]):
+            assert np.array_equal(
+                histonets.match_templates(image, templates, regions=regions),
+                matches[:1])
+        assert not len(histonets.match_templates(
+            image, templates, regions=[[[0, 0], [100, 100]]]))
+        sweep = histonets.match_templates_thresholds(
+            image, templates, [95], regions=[rectangle])
+        assert np.array_equal(sweep[0], matches[:1])
+
+    def test_match_templates_tiles(self):
+        image = self.image
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 20, 'flip': 'h'},
+            {'image': cv2.imread(fixtures_path('template_m.png')),
+             'threshold': 10, 'method': 'laplacian',
+             'mask': np.full((132, 170), 255, dtype=np.uint8)},
+        ]
+        matches, scores, indices = histonets.match_templates(
+            image, templates, overlap=0.5, return_scores=True)
+        for tile_size in (64, 200, 1000):
+            tiled_matches, tiled_scores, tiled_indices = (
+                histonets.match_templates(image, templates, overlap=0.5,
+                                          tile_size=tile_size,
+                                          return_scores=True))
+            assert np.array_equal(matches, tiled_matches)
+            assert np.array_equal(indices, tiled_indices)
+            assert np.allclose(scores, tiled_scores, atol=1e-4)
+        rectangle = [[250, 340], [340, 390]]
+        assert np.array_equal(
+            histonets.match_templates(image, templates, regions=[rectangle],
+                                      tile_size=32),
+            histonets.match_templates(image, templates, regions=[rectangle]))
+
+    def test_match_templates_chamfer(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        templates = [{'image': image[100:160, 200:260].copy(),
+                      'method': 'chamfer', 'threshold': 90}]
+        matches, scores, _ = histonets.match_templates(
+            image, templates, return_scores=True)
+        assert matches[0].tolist() == [[200, 100], [260, 160]]
+        assert np.isclose(scores[0], 1)
+        assert (scores >= 0.9).all()
+        matches = histonets.match_templates(image, templates, pyramid=1)
+        assert matches[0].tolist() == [[200, 100], [260, 160]]
+        bank = utils.TemplateBank(templates, pyramid=1)
+        assert np.array_equal(
+            histonets.match_templates(image, bank, pyramid=1), matches)
+
+    def test_match_templates_orb(self):
+        template = self.image[299:431, 209:379].copy()
+        templates = [{'image': template, 'method': 'orb', 'threshold': 90}]
+        matches = histonets.match_templates(self.image, templates)
+        assert matches.tolist() == [[[209, 299], [379, 431]]]
+        rotation = cv2.getRotationMatrix2D((256, 256), 30, 0.8)
+        image = cv2.warpAffine(self.image, rotation, (512, 512))
+        corners = cv2.transform(np.float32([[[209, 299], [379, 299],
+                                             [379, 431], [209, 431]]]),
+                                rotation)[0]
+        matches, scores, _ = histonets.match_templates(
+            image, templates, return_scores=True)
+        assert len(matches) == 1
+        box = [corners.min(axis=0), corners.max(axis=0)]
+        assert np.allclose(matches[0], box, atol=4)
+        assert scores[0] >= 0.9
+        bank = utils.TemplateBank(templates)
+        matches = histonets.match_templates(image, bank)
+        assert len(matches) == 1
+        assert np.allclose(matches[0], box, atol=4)
+
+    def test_match_templates_peaks(self):
+        image = self.image
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 40, 'flip': 'a'},
+        ]
+        matches = histonets.match_templates(image, templates)
+        peaks = histonets.match_templates(image, templates, peaks=True)
+        assert np.array_equal(matches[:1], peaks[:1])
+        limited = histonets.match_templates(image, templates, peaks=True,
+                                            max_matches=2)
+        assert len(peaks) > 2
+        assert np.array_equal(peaks[:2], limited)
+
+    def test_match_templates_max_matches(self):
+        templates = [{'image': cv2.imread(fixtures_path('template.png')),
+                      'threshold': 40, 'flip': 'a'}]
+        matches, scores, _ = histonets.match_templates(
+            self.image, templates, return_scores=True)
+        assert len(matches) > 5
+        for pyramid in (0, 1):
+            best_matches, best_scores, _ = histonets.match_templates(
+                self.image, templates, pyramid=pyramid, max_matches=5,
+                return_scores=True)
+            assert np.array_equal(best_matches, matches[:5])
+            assert np.allclose(best_scores, scores[:5], atol=1e-4)
+
+    def test_match_templates_thresholds_sweep(self):
+        image = self.image
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'flip': 'h'},
+            {'image': cv2.imread(fixtures_path('template_v.png')),
+             'flip': 'v'},
+        ]
+        thresholds = (95, 40, 150, 60)
+        sweep = histonets.match_templates_thresholds(image, templates,
+                                                     thresholds)
+        assert len(sweep) == len(thresholds)
+        for threshold, matches in zip(thresholds, sweep):
+            thresholded = [dict(template, threshold=threshold)
+                           for template in templates]
+            assert np.array_equal(
+                matches, histonets.match_templates(image, thresholded))
+        sweep = histonets.match_templates_thresholds(
+            image, templates, [80], return_scores=True)
+        matches, scores, indices = sweep[0]
+        assert len(matches) == len(scores) == len(indices)
+
+    def test_match_templates_batch(self):
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 95, 'flip': 'h'},
+            {'image': cv2.imread(fixtures_path('template_m.png')),
+             'threshold': 45, 'method': 'laplacian',
+             'mask': np.full((132, 170), 255, dtype=np.uint8)},
+        ]
+        images = [self.image, cv2.flip(self.image, 1),
+                  cv2.imread(fixtures_path('map.png'))]
+        for batch_workers in (1, 3):
+            pages = (image for image in images)
+            results = dict(histonets.match_templates_batch(
+                pages, templates, batch_workers=batch_workers))
+            assert sorted(results.keys()) == [0, 1, 2]
+            for position, image in enumerate(images):
+                assert np.array_equal(
+                    results[position],
+                    histonets.match_templates(image, templates))
+        results = dict(histonets.match_templates_batch(
+            images, templates, return_scores=True))
+        matches, scores, indices = results[0]
+        assert len(matches) == len(scores) == len(indices)
+
+    def test_match_templates_matching_image(self):
+        image = self.image
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 95},
+            {'image': cv2.imread(fixtures_path('template_m.png')),
+             'threshold': 45, 'method': 'laplacian',
+             'mask': np.full((132, 170), 255, dtype=np.uint8)},
+        ]
+        matching_image = utils.MatchingImage(image)
+        matches = histonets.match_templates(matching_image, templates)
+        assert np.array_equal(matches,
+                              histonets.match_templates(image, templates))
+        assert ('edges', 'laplacian') in matching_image._features
+
+    def test_match_templates_bank(self):
+        image = self.image
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 95, 'flip': 'h'},
+            {'image': cv2.imread(fixtures_path('template_m.png')),
+             'threshold': 45, 'method': 'laplacian',
+             'mask': np.full((132, 170), 255, dtype=np.uint8)},
+        ]
+        bank = utils.TemplateBank(templates, pyramid=1)
+        assert np.array_equal(histonets.match_templates(image, bank),
+                              histonets.match_templates(image, templates))
+        assert np.array_equal(
+            histonets.match_templates(image, bank, pyramid=1),
+            histonets.match_templates(image, templates, pyramid=1))
+
     def test_color_mask(self):
         image = cv2.imread(fixtures_path('poster_kmeans4.png'))
         image_mask = cv2.imread(fixtures_path('mask_tol50.png'), 0)  # B&W
@@ -502,6 +874,49 @@ class TestHistonets(unittest.TestCase):
         ridges = histonets.remove_ridges(image, return_mask=True)
         assert np.array_equal(mask, ridges)
 
+    def test_remove_ridges_widths(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        mask = cv2.imread(fixtures_path('map_ridge.png'), 0)
+        ridges = histonets.remove_ridges(image, [6], return_mask=True)
+        assert np.array_equal(mask, ridges)
+        ridges = histonets.remove_ridges(image, [3, 6], return_mask=True)
+        assert np.array_equal(
+            ridges,
+            histonets.remove_ridges(image, 3, return_mask=True) & mask
+        )
+
+    def test_detect_ridges(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        mask = cv2.imread(fixtures_path('map_ridge.png'), 0)
+        ridges = histonets.detect_ridges(image)
+        dilated = cv2.dilate(ridges, np.ones((3, 3), np.uint8))
+        assert np.array_equal(mask, 255 - dilated)
+
+    def test_detect_ridges_widths(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        widths = (3, 6, 12)
+        ridges, best_widths = histonets.detect_ridges(image, widths,
+                                                      return_widths=True)
+        assert best_widths.dtype == np.uint8
+        assert set(np.unique(best_widths)) <= {0, 3, 6, 12}
+        assert np.array_equal(ridges > 0, best_widths > 0)
+        union = np.zeros_like(ridges)
+        for width in widths:
+            union |= histonets.detect_ridges(image, width)
+        assert np.array_equal(ridges, union)
+
+    def test_detect_ridges_downsample(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        assert np.array_equal(histonets.detect_ridges(image, 3),
+                              histonets.detect_ridges(image, 3,
+                                                      downsample=True))
+        ridges = histonets.detect_ridges(image, 40, downsample=True)
+        assert ridges.shape == image.shape[:2]
+        assert set(np.unique(ridges)) <= {0, 255}
+        full = histonets.detect_ridges(image, 40) > 0
+        overlap = (full & (ridges > 0)).sum() / (full | (ridges > 0)).sum()
+        assert overlap > 0.5
+
     def test_remove_blobs(self):
         image = cv2.imread(fixtures_path('map_ridges_invert.png'))
         mask = cv2.imread(fixtures_path('map_noblobs8.png'))
@@ -532,6 +947,51 @@ class TestHistonets(unittest.TestCase):
         removed_mask = histonets.remove_blobs(image, 0, 100, return_mask=True)
         assert np.array_equal(mask, removed_mask)
 
+    def test_remove_blobs_components(self):
+        image = np.zeros((20, 30, 3), dtype=np.uint8)
+        image[2:4, 2:4] = 255  # 4 pixels
+        image[4, 4] = 255  # only 8-connected to the blob above
+        image[10:15, 10:20] = 255  # 50 pixels
+        removed = histonets.remove_blobs(image, 0, 10, engine='components')
+        assert not removed[:5, :5].any()
+        assert (removed[10:15, 10:20] == 255).all()
+        removed = histonets.remove_blobs(image, 0, 4, method='4-connected',
+                                         engine='components')
+        assert not removed[2:4, 2:4].any() and not removed[4, 4].any()
+        removed = histonets.remove_blobs(image, 0, 4, engine='components')
+        assert (removed[2:4, 2:4] == 255).all()
+
+    def test_remove_blobs_components_mask(self):
+        image = cv2.imread(fixtures_path('map_ridges_invert.png'))
+        mask = histonets.remove_blobs(image, 0, 100, engine='components',
+                                      return_mask=True)
+        assert mask.dtype == np.uint8 and mask.shape == image.shape[:2]
+        removed = histonets.remove_blobs(image, 0, 100, engine='components')
+        assert np.array_equal(removed,
+                              cv2.bitwise_and(image, image, mask=mask))
+
+    def test_remove_blobs_ranges(self):
+        image = cv2.imread(fixtures_path('map_ridges_invert.png'))
+        ranges = ((0, 100), (50, 500), (1000, sys.maxsize))
+        masks = histonets.remove_blobs_ranges(image, ranges, return_mask=True)
+        images = histonets.remove_blobs_ranges(image, ranges)
+        for (min_area, max_area), mask, removed in zip(ranges, masks, images):
+            assert np.array_equal(mask, histonets.remove_blobs(
+                image, min_area, max_area, engine='components',
+                return_mask=True))
+            assert np.array_equal(removed, histonets.remove_blobs(
+                image, min_area, max_area, engine='components'))
+
+    def test_blobs_stats(self):
+        image = np.zeros((20, 30), dtype=np.uint8)
+        image[2:4, 2:6] = 255
+        image[10:15, 10:20] = 255
+        blobs = histonets.blobs_stats(image)
+        assert blobs.labels.shape == image.shape
+        assert blobs.areas.tolist() == [8, 50]
+        assert blobs.bboxes.tolist() == [[2, 2, 4, 2], [10, 10, 10, 5]]
+        assert np.allclose(blobs.centroids, [[3.5, 2.5], [14.5, 12]])
+
     def test_binarize_already_binary_image(self):
         image = cv2.imread(fixtures_path('map_ridges_invert.png'), 0)
         binarized = histonets.binarize_image(image)
@@ -573,6 +1033,54 @@ class TestHistonets(unittest.TestCase):
                                              threshold=160)
         assert np.array_equal(image_binarized, binarized)
 
+    def test_binarize_boolean_method_keeps_input(self):
+        image = cv2.imread(fixtures_path('map.png'), 0)
+        original = image.copy()
+        histonets.binarize_image(image, method='boolean', threshold=160)
+        assert np.array_equal(image, original)
+
+    def test_binarize_non_uint8_image(self):
+        image = cv2.imread(fixtures_path('map.png'), 0)
+        binarized = histonets.binarize_image(image.astype(np.float64) / 255)
+        assert binarized.dtype == np.uint8
+        assert binarized.shape == image.shape
+        assert np.array_equal(np.unique(binarized), [0, 255])
+
+    def test_binarize_sauvola(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        binarized = histonets.binarize_image(image, method='sauvola')
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        assert binarized.dtype == np.uint8
+        assert binarized.shape == gray.shape
+        assert np.array_equal(binarized,
+                              utils.sauvola_binarize(gray, window_size=15))
+
+    def test_binarize_sauvola_params(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        binarized = histonets.binarize_image(image, method='sauvola')
+        binarized_params = histonets.binarize_image(
+            image, method='sauvola', window_size=31, k=0.5)
+        assert not np.array_equal(binarized, binarized_params)
+
+    def test_binarization_thresholds(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        thresholds = histonets.binarization_thresholds(image)
+        assert sorted(thresholds.keys()) == ['isodata', 'li', 'otsu']
+        assert thresholds['otsu'] == 180
+        assert thresholds['isodata'] == 180
+        assert 165 < thresholds['li'] < 166
+        for method, threshold in thresholds.items():
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            assert np.array_equal(
+                histonets.binarize_image(image, method=method),
+                255 * (gray <= threshold).astype(np.uint8)
+            )
+
+    def test_binarization_thresholds_methods(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        thresholds = histonets.binarization_thresholds(image, ['otsu'])
+        assert list(thresholds.keys()) == ['otsu']
+
     def test_dilate(self):
         image = cv2.imread(fixtures_path('map.png'))
         for dilation in (None, 1, 3):
@@ -584,6 +1092,23 @@ class TestHistonets(unittest.TestCase):
                 image_dilated = cv2.imread(fixtures_path(filename), 0)
                 assert np.array_equal(dilated, image_dilated)
 
+    def test_dilate_passes_merged(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        assert np.array_equal(
+            histonets.dilate_image(image, dilation=2, passes=3),
+            histonets.dilate_image(image, dilation=6, passes=1)
+        )
+        assert np.array_equal(
+            histonets.dilate_image(image, dilation=2, passes=0),
+            histonets.dilate_image(image, dilation=0)
+        )
+
+    def test_dilate_uint8(self):
+        image = cv2.imread(fixtures_path('map.png'))
+        dilated = histonets.dilate_image(image, dilation=3)
+        assert dilated.dtype == np.uint8
+        assert np.array_equal(np.unique(dilated), [0, 255])
+
     def test_dilate_all_black(self):
         image = np.zeros((64, 64))
         assert np.array_equal(image, histonets.dilate_image(image))
@@ -608,6 +1133,19 @@ class TestHistonets(unittest.TestCase):
         image = np.zeros((64, 64))
         assert np.array_equal(image, histonets.skeletonize_image(image))
 
+    def test_skeletonize_sparse_image(self):
+        image = np.zeros((200, 300), dtype=np.uint8)
+        image[80:90, 100:180] = 255
+        image[60:120, 140:146] = 255
+        skeleton = histonets.skeletonize_image(image, 'thin')
+        assert skeleton.shape == image.shape
+        assert not skeleton[:60].any() and not skeleton[:, :100].any()
+        window = (slice(40, 140), slice(80, 200))
+        assert np.array_equal(
+            skeleton[window],
+            histonets.skeletonize_image(image[window], 'thin')
+        )
+
     def test_skeletonize_invert(self):
         image = cv2.imread(fixtures_path('map.png'))
         skeleton = histonets.skeletonize_image(image, invert=True)
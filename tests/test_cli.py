@@ -11,14 +11,17 @@ import base64
 import io
 import json
 import os
+import sys
 import tempfile
 import unittest
+from unittest import mock
 
 import cv2
 import networkx as nx
 import numpy as np
 from click.testing import CliRunner
 
+import histonets_cv as histonets
 from histonets_cv import cli, utils
 
 
@@ -210,6 +213,19 @@ class TestHistonetsCli(unittest.TestCase):
         result = self.runner.invoke(cli.smooth, ['50', self.image_file])
         assert test_smooth_image == result.output.rstrip()
 
+    def test_smooth_guided(self):
+        result = self.runner.invoke(cli.smooth,
+                                    ['50', '-m', 'guided', self.image_file])
+        assert 'Error' not in result.output
+        image = cv2.imread(self.image_png)
+        assert np.array_equal(decode_base64(result.output.strip()),
+                              histonets.smooth_image(image, 50, 'guided'))
+
+    def test_smooth_invalid_method(self):
+        result = self.runner.invoke(cli.smooth,
+                                    ['50', '-m', 'wrong', self.image_file])
+        assert 'Error' in result.output
+
     def test_histogram_equalization_invalid_value(self):
         result = self.runner.invoke(cli.equalize, ['150', self.image_file])
         assert 'Invalid value for "value"' in result.output
@@ -232,6 +248,29 @@ class TestHistonetsCli(unittest.TestCase):
         result = self.runner.invoke(cli.denoise, ['10', self.image_file])
         assert test_denoise_image == result.output.rstrip()
 
+    def test_denoise_options(self):
+        result = self.runner.invoke(
+            cli.denoise,
+            ['10', '-l', '-f', '-s', '50', self.image_file]
+        )
+        assert 'Error' not in result.output
+        image = cv2.imread(self.image_png)
+        denoised = histonets.denoise_image(image, 10, luma=True, fast=True,
+                                           scale=50)
+        assert np.array_equal(decode_base64(result.output.strip()), denoised)
+
+    def test_denoise_auto(self):
+        result = self.runner.invoke(cli.denoise, ['0', '-a', self.image_file])
+        assert 'Error' not in result.output
+        image = cv2.imread(self.image_png)
+        denoised = histonets.denoise_image(image, 0, auto=True)
+        assert np.array_equal(decode_base64(result.output.strip()), denoised)
+
+    def test_denoise_invalid_scale(self):
+        result = self.runner.invoke(cli.denoise,
+                                    ['10', '-s', '0', self.image_file])
+        assert 'Error' in result.output
+
     def test_command_pipeline(self):
         actions = json.dumps([
             {'action': 'brightness', 'options': {'value': 150}},
@@ -260,6 +299,33 @@ class TestHistonetsCli(unittest.TestCase):
         )
         assert test_pipeline_full == result.output.strip()
 
+    def test_command_pipeline_point_operations(self):
+        actions = json.dumps([
+            {"action": "brightness", "options": {"value": 122}},
+            {"action": "contrast", "options": {"value": 122}},
+            {"action": "smooth", "options": {"value": 12}},
+            {"action": "contrast", "options": {"value": 80}},
+        ])
+        result = self.runner.invoke(cli.pipeline, [actions, self.image_file])
+        assert 'Error' not in result.output
+        image = cv2.imread(self.image_png)
+        image = histonets.adjust_brightness(image, 122)
+        image = histonets.adjust_contrast(image, 122)
+        image = histonets.smooth_image(image, 12)
+        image = histonets.adjust_contrast(image, 80)
+        assert np.array_equal(decode_base64(result.output.strip()), image)
+
+    def test_command_pipeline_smooth_guided(self):
+        actions = json.dumps([
+            {"action": "smooth", "options": {"value": 50,
+                                             "method": "guided"}},
+        ])
+        result = self.runner.invoke(cli.pipeline, [actions, self.image_file])
+        assert 'Error' not in result.output
+        image = cv2.imread(self.image_png)
+        assert np.array_equal(decode_base64(result.output.strip()),
+                              histonets.smooth_image(image, 50, 'guided'))
+
     def test_command_pipeline_invalid(self):
         actions = json.dumps([
             {'action': 'command not found', 'options': {'value': 50}},
@@ -385,6 +451,138 @@ class TestHistonetsCli(unittest.TestCase):
         assert 'Error' not in result.output
         assert [[[259, 349], [329, 381]]] == json.loads(result.output)
 
+    def test_command_match_jobs(self):
+        result = self.runner.invoke(
+            cli.match,
+            [self.image_template, '-th', 95, '-j', 4, self.image_file]
+        )
+        assert 'Error' not in result.output
+        assert [[[259, 349], [329, 381]]] == json.loads(result.output)
+
+    def test_command_match_engine(self):
+        # pairing of options reads the arguments from the command line
+        args = [self.image_template, '-en', 'fft', '-th', '95',
+                self.image_template, '-th', '5', '-f', 'h', '-pk',
+                self.image_file]
+        with mock.patch.object(sys, 'argv', ['histonets', 'match'] + args):
+            result = self.runner.invoke(cli.match, args)
+        assert 'Error' not in result.output
+        assert result.exception is None
+        assert [[259, 349], [329, 381]] in json.loads(result.output)
+
+    def test_command_match_pyramid(self):
+        result = self.runner.invoke(
+            cli.match,
+            [self.image_template, '-th', 95, '-p', 2, self.image_file]
+        )
+        assert 'Error' not in result.output
+        assert [[[259, 349], [329, 381]]] == json.loads(result.output)
+
+    def test_command_match_sweep(self):
+        result = self.runner.invoke(
+            cli.match,
+            [self.image_template, '-sw', 95, '-sw', 5, self.image_file]
+        )
+        assert 'Error' not in result.output
+        output = json.loads(result.output)
+        assert sorted(output.keys()) == ['5', '95']
+        assert [[[259, 349], [329, 381]]] == output['95']
+        assert len(output['5']) > 1
+
+    def test_command_match_tile_size(self):
+        result = self.runner.invoke(
+            cli.match,
+            [self.image_template, '-th', 95, '-ts', 100, self.image_file]
+        )
+        assert 'Error' not in result.output
+        assert [[[259, 349], [329, 381]]] == json.loads(result.output)
+
+    def test_command_match_region(self):
+        result = self.runner.invoke(
+            cli.match,
+            [self.image_template, '-th', 95,
+             '-r', json.dumps([[250, 340], [340, 390]]),
+             '-r', json.dumps([[0, 0], [100, 0], [100, 100]]),
+             self.image_file]
+        )
+        assert 'Error' not in result.output
+        assert [[[259, 349], [329, 381]]] == json.loads(result.output)
+        result = self.runner.invoke(
+            cli.match,
+            [self.image_template, '-th', 95,
+             '-r', json.dumps([[0, 0], [100, 100]]), self.image_file]
+        )
+        assert 'Error' not in result.output
+        assert [] == json.loads(result.output)
+
+    def test_command_match_pages(self):
+        result = self.runner.invoke(
+            cli.match,
+            [self.image_template, '-th', 95, '-pg', self.image_map,
+             '-pg', self.image_file, '-pj', 2, self.image_file]
+        )
+        assert 'Error' not in result.output
+        matches = [[[259, 349], [329, 381]]]
+        assert [matches, [], matches] == json.loads(result.output)
+
+    def test_command_match_pages_invalid(self):
+        missing = 'file://' + fixtures_path('missing.png')
+        result = self.runner.invoke(
+            cli.match,
+            [self.image_template, '-pg', self.image_file, '-pg', missing,
+             self.image_file]
+        )
+        assert 'Error' in result.output
+        assert missing in result.output
+
+    def test_command_match_bank(self):
+        bank = os.path.join(tempfile.mkdtemp(), 'bank')
+        result = self.runner.invoke(
+            cli.main,
+            ['templates', 'build', self.image_template, '-th', 95, bank]
+        )
+        assert 'Error' not in result.output
+        result = self.runner.invoke(cli.match, ['-b', bank, self.image_file])
+        assert 'Error' not in result.output
+        assert [[[259, 349], [329, 381]]] == json.loads(result.output)
+
+    def test_command_templates_build_page_size(self):
+        bank = os.path.join(tempfile.mkdtemp(), 'bank')
+        args = ['templates', 'build', self.image_template, '-ps', '640',
+                '480', '-th', '95', self.image_template_h, '-th', '50',
+                bank]
+        with mock.patch.object(sys, 'argv', ['histonets'] + args):
+            result = self.runner.invoke(cli.main, args)
+        assert 'Error' not in result.output
+        assert result.exception is None
+        pairs = utils.TemplateBank.load(bank).pairs
+        assert [(pair[2], pair[3]) for pair in pairs] == [(0.95, 0),
+                                                          (0.5, 1)]
+        assert pairs[0][0].export_features()[
+            ('spectrum', (480, 640), False)].shape == (480, 640)
+
+    def test_command_match_bank_invalid(self):
+        result = self.runner.invoke(
+            cli.match,
+            ['-b', tempfile.mkdtemp(), self.image_file]
+        )
+        assert 'Error' in result.output
+        result = self.runner.invoke(cli.match, [self.image_file])
+        assert 'Error' in result.output
+        bank = tempfile.mkdtemp()
+        build = ['templates', 'build', self.image_template, bank]
+        result = self.runner.invoke(cli.main, build)
+        assert 'Error' not in result.output
+        result = self.runner.invoke(cli.main, build)
+        assert 'Error' in result.output
+        result = self.runner.invoke(cli.main, build + ['-ow'])
+        assert 'Error' not in result.output
+        result = self.runner.invoke(
+            cli.match,
+            [self.image_template, '-b', bank, self.image_file]
+        )
+        assert 'Error' in result.output
+
     def test_command_match_default(self):
         result_default = self.runner.invoke(
             cli.match,
@@ -528,6 +726,18 @@ class TestHistonetsCli(unittest.TestCase):
         mask = encode_base64(fixtures_path('map_ridge.png'))
         assert mask == result.output.strip()
 
+    def test_command_ridges_widths(self):
+        result = self.runner.invoke(
+            cli.ridges,
+            ['-w', 3, '-w', 6, '-ds', '-m',
+             self.image_map]
+        )
+        image = cv2.imread(fixtures_path('map.png'))
+        mask = histonets.remove_ridges(image, [3, 6], 128, downsample=True,
+                                       return_mask=True)
+        output = decode_base64(result.output.strip())
+        assert np.array_equal(cv2.cvtColor(output, cv2.COLOR_BGR2GRAY), mask)
+
     def test_command_blobs(self):
         result = self.runner.invoke(
             cli.blobs,
@@ -564,6 +774,18 @@ class TestHistonetsCli(unittest.TestCase):
         masked = encode_base64(fixtures_path('map_noblobs_antialiased.png'))
         assert masked == result.output.strip()
 
+    def test_command_blobs_components(self):
+        result = self.runner.invoke(
+            cli.blobs,
+            ['-min', 0, '-max', 100, '-c', 4, '-e', 'components', '-m',
+             self.image_map_ridges],
+        )
+        image = cv2.imread(fixtures_path('map_ridges_invert.png'))
+        mask = histonets.remove_blobs(image, 0, 100, method='4-connected',
+                                      engine='components', return_mask=True)
+        output = decode_base64(result.output.strip())
+        assert np.array_equal(cv2.cvtColor(output, cv2.COLOR_BGR2GRAY), mask)
+
     def test_binarize_default(self):
         result = self.runner.invoke(
             cli.binarize,
@@ -12,6 +12,8 @@ import json
 import os
 import locale
 import subprocess
+import tempfile
+import threading
 import unittest
 
 import click
@@ -23,6 +25,7 @@ from click.testing import CliRunner
 from collections import namedtuple
 from imutils import object_detection
 from networkx.readwrite import json_graph as nx_json_graph
+from skimage.filters import threshold_sauvola
 from sklearn.cluster import MiniBatchKMeans
 from sklearn.datasets.samples_generator import make_blobs
 
@@ -140,6 +143,35 @@ class TestHistonetsUtils(unittest.TestCase):
         self.assertRaises(click.BadParameter, utils.parse_pipeline_json,
                           None, None, string)
 
+    def test_point_operation(self):
+        image = np.arange(256, dtype=np.uint8).reshape(16, 16)
+        identity = utils.PointOperation()
+        assert np.array_equal(identity(image), image)
+        scale = utils.PointOperation.scale(2)
+        shift = utils.PointOperation.shift(-100)
+        assert scale(image).max() == 255
+        assert np.array_equal(scale.then(shift)(image),
+                              shift(scale(image)))
+        assert not np.array_equal(scale.then(shift)(image),
+                                  scale(shift(image)))
+
+    def test_point_operation_stretch(self):
+        image = np.arange(50, 150, dtype=np.uint8).reshape(10, 10)
+        stretched = utils.PointOperation.stretch(50, 149)(image)
+        assert stretched.min() == 0
+        assert stretched.max() == 255
+
+    def test_point_operation_inplace(self):
+        image = np.arange(256, dtype=np.uint8).reshape(16, 16)
+        output = utils.PointOperation.scale(0.5)(image, inplace=True)
+        assert output is image or np.shares_memory(output, image)
+        assert image.max() == 127
+
+    def test_get_clahe(self):
+        assert utils.get_clahe(8) is utils.get_clahe(8)
+        assert utils.get_clahe(8) is not utils.get_clahe(16)
+        assert utils.get_clahe(8).getTilesGridSize() == (8, 8)
+
     def test_image_as_array(self):
         image = utils.Image.get_images([self.image_file])[0]
         func = utils.image_as_array(lambda x: x)
@@ -243,6 +275,28 @@ class TestHistonetsUtils(unittest.TestCase):
         assert ([["t1", "t2", "t3"], ["1", 0, 0], [1, "3", 1]]
                 == json.loads(output))
 
+    def test_pair_options_to_argument_args_unpaired(self):
+        args = ['im', 't1', '-oo', 'x', '-o', '1', '-s', '2', '3', '-fl',
+                't2', 't3', '-o', '3']
+
+        @click.command()
+        @click.argument('img')
+        @click.argument('arg', nargs=-1, required=True)
+        @click.option('-o', '--option', multiple=True)
+        @click.option('-oo', '--other-option')
+        @click.option('-s', '--size', nargs=2)
+        @click.option('-fl', '--flag', is_flag=True)
+        @utils.pair_options_to_argument(
+            'arg', {'option': 0}, args=args, args_slice=(1, None)
+        )
+        def command(img, arg, option, other_option, size, flag):
+            click.echo(json.dumps((arg, option)))
+
+        runner = CliRunner()
+        output = runner.invoke(command, args).output
+        assert 'Error' not in output
+        assert [["t1", "t2", "t3"], ["1", 0, "3"]] == json.loads(output)
+
     def test_pair_options_to_argument_args_default(self):
         args = ['im', 't1', 't2', 't3']
 
@@ -296,6 +350,102 @@ main()
         self.assertRaises(click.BadParameter, utils.parse_jsons,
                           None, None, string)
 
+    def test_dilate_square(self):
+        image = np.zeros((64, 64), dtype=np.uint8)
+        image[10, 20] = 255
+        dilated = utils.dilate_square(image, 3)
+        assert dilated.sum() == 49 * 255
+        assert dilated[7:14, 17:24].all()
+        assert np.array_equal(utils.dilate_square(image, 0), image)
+
+    def test_dilate_square_large_radius(self):
+        image = np.zeros((600, 700), dtype=np.uint8)
+        image[50, 80] = image[500, 620] = 255
+        radius = utils.DISTANCE_DILATION_RADIUS + 10
+        size = 2 * radius + 1
+        assert np.array_equal(
+            utils.dilate_square(image, radius),
+            cv2.dilate(image, np.ones((size, size), np.uint8))
+        )
+
+    def test_get_skeleton(self):
+        image = np.zeros((32, 48), dtype=bool)
+        image[10:15, 5:40] = True
+        for method in ('3d', 'regular', 'thin', 'medial', None):
+            skeleton = utils.get_skeleton(image, method)
+            assert skeleton.shape == image.shape
+            assert skeleton.any()
+            assert not (skeleton.astype(bool) & ~image).any()
+
+    def test_get_skeleton_combined(self):
+        image = np.zeros((32, 48), dtype=bool)
+        image[10:15, 5:40] = True
+        image[5:25, 20:23] = True
+        combined = utils.get_skeleton(image, 'combined')
+        assert np.array_equal(combined == 255,
+                              utils.get_skeleton(image, '3d') > 0)
+        assert np.array_equal(
+            combined > 0,
+            (utils.get_skeleton(image, '3d') > 0)
+            | utils.get_skeleton(image, 'medial')
+            | utils.get_skeleton(image, 'regular')
+        )
+
+    def test_gaussian_kernel(self):
+        kernel = utils.gaussian_kernel(2)
+        assert kernel.dtype == np.float32
+        assert kernel.size == 17
+        assert np.isclose(kernel.sum(), 1)
+        assert np.argmax(kernel) == 8
+        assert np.allclose(kernel, kernel[::-1])
+
+    def test_hessian_ridges(self):
+        image = np.full((40, 50), 255, dtype=np.uint8)
+        image[:, 24:27] = 0  # dark vertical ridge
+        eigenvalues = utils.hessian_ridges(image, 1.5)
+        assert eigenvalues.dtype == np.float32
+        assert eigenvalues.shape == image.shape
+        # the largest eigenvalue peaks along the center of the ridge
+        assert eigenvalues[20, 25] > 0
+        assert np.argmax(eigenvalues[20]) == 25
+
+    def test_hessian_ridges_bands(self):
+        image = cv2.imread(self.image_png, 0)
+        eigenvalues = utils.hessian_ridges(image, 2)
+        for band_size in (image.shape[1], 7 * image.shape[1]):
+            assert np.allclose(
+                utils.hessian_ridges(image, 2, band_size=band_size),
+                eigenvalues
+            )
+
+    def test_ridges_downsampling(self):
+        assert utils.ridges_downsampling(0.5) == 1
+        assert utils.ridges_downsampling(utils.COARSE_RIDGES_SIGMA) == 1
+        assert utils.ridges_downsampling(utils.COARSE_RIDGES_SIGMA + 1) == 2
+        sigma = (100 / 2) / np.sqrt(3)
+        factor = utils.ridges_downsampling(sigma)
+        assert sigma / factor <= utils.COARSE_RIDGES_SIGMA
+
+    def test_get_connectivity(self):
+        assert utils.get_connectivity('4-connected') == 4
+        assert utils.get_connectivity('8-connected') == 8
+        assert utils.get_connectivity('16-connected') == 8
+        assert utils.get_connectivity('antialiased') == 8
+
+    def test_get_blobs_mask(self):
+        image = np.zeros((10, 10), dtype=np.uint8)
+        image[1, 1] = image[2, 2] = 255
+        image[5:8, 5:8] = 255
+        blobs = utils.get_blobs(image, 4)
+        assert blobs.areas.tolist() == [1, 1, 9]
+        mask = utils.get_blobs_mask(blobs, 0, 1)
+        assert mask.dtype == np.uint8
+        assert mask[1, 1] == mask[2, 2] == 0
+        assert (mask[5:8, 5:8] == 255).all()
+        blobs = utils.get_blobs(image, 8)
+        assert blobs.areas.tolist() == [2, 9]
+        assert (utils.get_blobs_mask(blobs, 2) == 255 - image).all()
+
     def test_get_mask_polygons(self):
         output = np.array(
            [[0, 0, 0, 0],
@@ -344,6 +494,412 @@ main()
             matches = boxes.reshape(boxes.shape[0], 2, 2)
             assert np.array_equal(test_matches, matches)
 
+    def test_histogram_median(self):
+        values = np.random.randint(0, 256, size=1001, dtype=np.uint8)
+        for sample in (values, values[:-1]):
+            histogram = np.bincount(sample, minlength=256)
+            assert utils.histogram_median(histogram) == np.median(sample)
+
+    def test_matching_image(self):
+        image = cv2.imread(self.image_png)
+        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        template = cv2.cvtColor(cv2.imread(fixtures_path('template_m.png')),
+                                cv2.COLOR_BGR2GRAY)
+        matching_image = utils.MatchingImage(image)
+        assert np.array_equal(matching_image.image, gray_image)
+        assert matching_image.median() == np.median(gray_image)
+        assert matching_image.median(template) == np.median(
+            np.hstack([gray_image.ravel(), template.ravel()]))
+        edges = matching_image.edges('laplacian')
+        assert matching_image.edges('laplacian') is edges
+        assert np.array_equal(edges, utils.get_edges(gray_image, 'laplacian'))
+        canny = matching_image.edges('canny', 50, 150)
+        assert np.array_equal(canny, cv2.Canny(gray_image, 50, 150))
+        assert matching_image.edges('canny', 50, 150) is canny
+
+    def test_cached_features_threads(self):
+        features = utils.CachedFeatures()
+        computing = threading.Event()
+        computed = threading.Event()
+
+        def first():
+            computing.set()
+            # only returns True if 'second' can be computed meanwhile
+            return computed.wait(5)
+
+        def second():
+            computed.set()
+            return 2
+
+        thread = threading.Thread(target=features._cached,
+                                  args=('first', first))
+        thread.start()
+        computing.wait(5)
+        assert features._cached('second', second) == 2
+        thread.join()
+        assert features._cached('first', first) is True
+
+    def test_match_template_mask_matching_image(self):
+        image = cv2.cvtColor(cv2.imread(self.image_png), cv2.COLOR_BGR2GRAY)
+        template = cv2.cvtColor(cv2.imread(fixtures_path('template_m.png')),
+                                cv2.COLOR_BGR2GRAY)
+        mask = np.full(template.shape, 255, dtype=np.uint8)
+        mask[:40] = 0
+        matching_image = utils.MatchingImage(image)
+        for method in (None, 'canny', 'laplacian', 'sobel'):
+            assert np.array_equal(
+                utils.match_template_mask(matching_image, template, mask,
+                                          method),
+                utils.match_template_mask(image, template, mask, method)
+            )
+
+    def test_match_template_fft(self):
+        image = cv2.imread(self.image_png, 0)
+        template = cv2.imread(fixtures_path('template.png'), 0)
+        matching_image = utils.MatchingImage(image)
+        for transformation in utils.get_flips('a'):
+            flipped = transformation(template)
+            results = utils.match_template_fft(matching_image, flipped)
+            expected = cv2.matchTemplate(image, flipped, cv2.TM_CCOEFF_NORMED)
+            assert results.dtype == np.float32
+            assert results.shape == expected.shape
+            assert np.allclose(results, expected, atol=1e-3)
+        flat = np.full((10, 12), 7, dtype=np.uint8)
+        assert (utils.match_template_fft(image, flat) == 1).all()
+
+    def test_matching_image_window_norms(self):
+        image = cv2.imread(self.image_png, 0)
+        matching_image = utils.MatchingImage(image)
+        norms = matching_image.window_norms((10, 12))
+        window = image[5:15, 7:19].astype(np.float64)
+        assert np.isclose(norms[5, 7], np.linalg.norm(window - window.mean()),
+                          rtol=1e-4)
+        assert matching_image.window_norms((10, 12)) is norms
+        for size in range(utils.WINDOW_NORMS_SHAPES):
+            matching_image.window_norms((size + 1, size + 1))
+        assert matching_image.window_norms((10, 12)) is not norms
+        assert np.array_equal(matching_image.window_norms((10, 12)), norms)
+
+    def test_match_template_masked_fft(self):
+        image = cv2.imread(self.image_png, 0)
+        template = cv2.imread(fixtures_path('template_m.png'), 0)
+        mask = np.full(template.shape, 255, dtype=np.uint8)
+        results = utils.match_template_masked_fft(image, template, mask)
+        assert np.allclose(results, utils.match_template_fft(image, template),
+                           atol=1e-3)
+        mask[:50] = mask[82:] = mask[:, :50] = mask[:, 120:] = 0
+        results = utils.match_template_masked_fft(image, template, mask)
+        window = image[299:299 + 132, 209:209 + 170].astype(np.float64)
+        selected = mask > 0
+        expected = np.corrcoef(window[selected],
+                               template[selected].astype(np.float64))[0, 1]
+        assert np.isclose(results[299, 209], expected, atol=1e-3)
+        assert not utils.match_template_masked_fft(
+            image, template, np.zeros_like(mask)).any()
+
+    def test_matching_image_crop_pyramid(self):
+        image = cv2.imread(self.image_png, 0)
+        matching_image = utils.MatchingImage(image)
+        cropped = matching_image.crop(10, 110, 20, 220)
+        assert np.array_equal(cropped.image, image[10:110, 20:220])
+        assert cropped.median() == matching_image.median()
+        edges = matching_image.edges('laplacian')
+        assert np.array_equal(cropped.edges('laplacian'),
+                              edges[10:110, 20:220])
+        assert matching_image.pyramid(0) is matching_image
+        assert matching_image.pyramid(2) is matching_image.pyramid(2)
+        assert np.array_equal(matching_image.pyramid(2).image,
+                              cv2.pyrDown(cv2.pyrDown(image)))
+
+    def test_match_template_pyramid(self):
+        image = cv2.imread(self.image_png, 0)
+        template = cv2.imread(fixtures_path('template.png'), 0)
+        results = utils.match_template_mask(image, template)
+        coords, probs = utils.get_match_candidates(results, 0.8,
+                                                   template.shape)
+        for levels in (1, 2, 10):
+            pyramid_coords, pyramid_probs = utils.match_template_pyramid(
+                image, template, 0.8, levels=levels)
+            assert np.array_equal(coords, pyramid_coords)
+            assert np.allclose(probs, pyramid_probs)
+
+    def test_match_template_chamfer(self):
+        image = cv2.imread(fixtures_path('map.png'), 0)
+        template = image[100:160, 200:260]
+        matching_image = utils.MatchingImage(image)
+        results = utils.match_template_chamfer(matching_image, template)
+        assert results.shape == (369, 369)
+        assert np.isclose(results[100, 200], 1)
+        assert results.min() >= 0
+        # mean of the truncated distances at the template edge points
+        edges = utils.MatchingTemplate(template).edge_kernel > 0
+        distances = matching_image.distances[50:110, 150:210][edges]
+        assert np.isclose(results[50, 150], 1 - distances.mean()
+                          / utils.CHAMFER_DISTANCE, atol=1e-4)
+        crop = matching_image.crop(50, 250, 150, 350)
+        assert np.allclose(utils.match_template_chamfer(crop, template),
+                           results[50:191, 150:291], atol=1e-4)
+
+    def test_get_keypoints(self):
+        image = cv2.imread(self.image_png, 0)
+        points, descriptors = utils.get_keypoints(image, 100)
+        assert 0 < len(points) <= 100
+        assert points.shape == (len(points), 2)
+        assert descriptors.shape == (len(points), 32)
+        mask = np.zeros_like(image)
+        points, descriptors = utils.get_keypoints(image, 100, mask)
+        assert points.shape == (0, 2)
+        assert descriptors.shape == (0, 32)
+
+    def test_get_similarity_inliers(self):
+        source = np.random.RandomState(1).uniform(0, 100, (40, 2))
+        rotation = cv2.getRotationMatrix2D((50, 50), 30, 0.8)
+        target = cv2.transform(source[None], rotation)[0]
+        target[30:] += 20  # outliers
+        inliers = utils.get_similarity_inliers(source, target)
+        assert inliers[:30].all() and not inliers[30:].any()
+        transform = utils.get_similarity_transform(source[inliers],
+                                                   target[inliers])
+        assert np.allclose(transform, rotation)
+
+    def test_get_window_score(self):
+        image = cv2.imread(self.image_png, 0)
+        window = image[100:150, 200:280]
+        template = utils.MatchingTemplate(image[105:155, 190:270])
+        results = cv2.matchTemplate(window, template.image,
+                                    cv2.TM_CCOEFF_NORMED)
+        assert np.isclose(utils.get_window_score(window, template),
+                          results[0, 0], atol=1e-4)
+        assert np.isclose(utils.get_window_score(template.image, template), 1)
+
+    def test_template_bank(self):
+        image = cv2.imread(self.image_png, 0)
+        templates = [
+            {'image': cv2.imread(fixtures_path('template.png')),
+             'threshold': 95, 'flip': 'all'},
+            {'image': cv2.imread(fixtures_path('template_m.png')),
+             'threshold': 45, 'method': 'laplacian',
+             'mask': np.full((132, 170), 255, dtype=np.uint8)},
+        ]
+        bank = utils.TemplateBank(templates, pyramid=2, shape=image.shape)
+        assert len(bank) == 2
+        assert len(bank.pairs) == 5
+        path = tempfile.mkdtemp()
+        bank.save(path)
+        loaded = utils.TemplateBank.load(path)
+        assert len(loaded.pairs) == len(bank.pairs)
+        for pair, loaded_pair in zip(bank.pairs, loaded.pairs):
+            template, loaded_template = pair[0], loaded_pair[0]
+            assert pair[1:] == loaded_pair[1:]
+            assert isinstance(loaded_template.image, np.memmap)
+            assert loaded_template.norm == template.norm
+            assert np.array_equal(loaded_template.pyramid(2).image,
+                                  template.pyramid(2).image)
+            assert np.array_equal(
+                utils.get_match_scores(image, loaded_template, engine='fft'),
+                utils.get_match_scores(image, template, engine='fft'))
+
+    def test_template_bank_duplicates(self):
+        template = cv2.imread(fixtures_path('template.png'))
+        noisy = cv2.add(template, np.full_like(template, 2))
+        noisy[0, 0] = 0
+        templates = [
+            {'image': template, 'threshold': 95},
+            {'image': cv2.imread(fixtures_path('template_h.png')),
+             'threshold': 95},
+            {'image': noisy, 'threshold': 90},
+        ]
+        bank = utils.TemplateBank(templates)
+        assert bank.groups == [[0, 2], [1]]
+        assert bank.pairs[2][0].representative is bank.pairs[0][0]
+        assert np.array_equal(bank.pairs[2][0].image,
+                              cv2.cvtColor(noisy, cv2.COLOR_BGR2GRAY))
+        path = tempfile.mkdtemp()
+        bank.save(path)
+        with self.assertRaises(FileExistsError):
+            bank.save(path)
+        bank.save(path, overwrite=True)
+        loaded = utils.TemplateBank.load(path)
+        assert loaded.groups == bank.groups
+        assert loaded.pairs[2][0].representative is loaded.pairs[0][0]
+        assert [pair[2:] for pair in loaded.pairs] == [
+            pair[2:] for pair in bank.pairs]
+        image = utils.MatchingImage(cv2.imread(self.image_png))
+        coords, probs, indices = utils.get_templates_candidates(
+            image, bank.pairs)
+        assert (probs[indices == 0] >= 0.95).all()
+        assert (probs[indices == 2] >= 0.90).all()
+        # near-duplicates are scored with their own template
+        assert np.allclose(probs[indices == 2], utils.get_boxes_scores(
+            image, bank.pairs[2][0], coords[indices == 2], 'canny'))
+
+    def test_template_bank_duplicates_scores(self):
+        image = utils.MatchingImage(cv2.imread(self.image_png))
+        template = cv2.imread(fixtures_path('template.png'))
+        similar = template.copy()
+        similar[:8, :8] = 255 - similar[:8, :8]
+        templates = [{'image': template, 'threshold': 50, 'method': None},
+                     {'image': similar, 'threshold': 50, 'method': None}]
+        bank = utils.TemplateBank(templates)
+        assert bank.groups == [[0, 1]]
+        coords, probs, indices = utils.get_templates_candidates(
+            image, bank.pairs)
+        for index, pair in enumerate(utils.get_templates_pairs(templates)):
+            expected_coords, expected_probs, _ = (
+                utils.get_templates_candidates(image, [pair]))
+            assert np.array_equal(coords[indices == index], expected_coords)
+            assert np.allclose(probs[indices == index], expected_probs,
+                               atol=1e-5)
+
+    def test_get_window_norms(self):
+        image = np.random.randint(0, 256, size=(30, 40), dtype=np.uint8)
+        norms = utils.get_window_norms(image, (5, 7))
+        assert norms.shape == (26, 34)
+        window = image[3:8, 10:17].astype(np.float64)
+        assert np.isclose(norms[3, 10],
+                          np.linalg.norm(window - window.mean()), rtol=1e-5)
+
+    def test_get_match_candidates(self):
+        results = np.zeros((20, 30), dtype=np.float32)
+        results[5, 7] = 0.9
+        results[5, 8] = 0.8
+        results[15, 20] = 0.7
+        results[2, 25] = 0.95
+        coords, probs = utils.get_match_candidates(results, 0.75, (4, 3))
+        assert len(coords) == 3
+        assert [7, 5, 10, 9] in coords.tolist()
+        coords, probs = utils.get_match_candidates(
+            results, 0.5, (4, 3), offset=(100, 200), peaks=True)
+        assert sorted(coords.tolist()) == [
+            [107, 205, 110, 209], [120, 215, 123, 219], [125, 202, 128, 206]]
+        coords, probs = utils.get_match_candidates(results, 0.5, (4, 3),
+                                                   max_matches=2)
+        assert sorted(probs.tolist()) == sorted([np.float32(0.9),
+                                                 np.float32(0.95)])
+
+    def test_select_best(self):
+        scores = np.array([0.1, 0.5, 0.3, 0.9, 0.7])
+        assert sorted(utils.select_best(scores, 2)) == [3, 4]
+        assert sorted(utils.select_best(scores, 10)) == [0, 1, 2, 3, 4]
+        assert utils.select_best(scores, 0).size == 0
+
+    def test_non_max_suppression(self):
+        boxes = np.array([
+            [0, 0, 10, 10],
+            [1, 1, 11, 11],
+            [20, 20, 30, 30],
+            [2, 0, 12, 10],
+        ])
+        scores = np.array([0.9, 0.95, 0.5, 0.7])
+        keep = utils.non_max_suppression(boxes, scores, 0.15)
+        assert keep.tolist() == [1, 2]
+        expected = object_detection.non_max_suppression(boxes, scores, 0.15)
+        assert np.array_equal(boxes[keep], expected)
+        labels = np.array([0, 1, 0, 0])
+        keep = utils.non_max_suppression(boxes, scores, 0.15, labels)
+        assert keep.tolist() == [1, 0, 2]
+        assert utils.non_max_suppression(boxes[:0], scores[:0]).size == 0
+
+    def test_non_max_suppression_imutils(self):
+        random = np.random.RandomState(0)
+        for _ in range(50):
+            corners = random.randint(0, 200, size=(100, 2))
+            sizes = random.randint(5, 40, size=(100, 2))
+            boxes = np.hstack([corners, corners + sizes])
+            # rounded scores tie often
+            scores = np.round(random.rand(100), 1)
+            keep = utils.non_max_suppression(boxes, scores, 0.15)
+            expected = object_detection.non_max_suppression(boxes, scores,
+                                                            0.15)
+            assert np.array_equal(boxes[keep], expected)
+
+    def test_guided_filter(self):
+        image = cv2.imread(self.image_png)
+        smoothed = utils.guided_filter(image, 4, 100)
+        assert smoothed.shape == image.shape
+        assert smoothed.dtype == np.uint8
+        assert smoothed.std() < image.std()
+        assert np.array_equal(utils.guided_filter(image, 0, 100), image)
+
+    def test_guided_filter_flat_image(self):
+        image = np.full((32, 32), 128, dtype=np.uint8)
+        assert np.array_equal(utils.guided_filter(image, 8, 100), image)
+
+    def test_guided_filter_with_guide(self):
+        image = cv2.imread(self.image_png)
+        guide = cv2.GaussianBlur(image, (5, 5), 0)
+        filtered = utils.guided_filter(image, 2, 1, guide=guide)
+        assert filtered.shape == image.shape
+        assert not np.array_equal(filtered, utils.guided_filter(image, 2, 1))
+
+    def test_estimate_noise(self):
+        image = cv2.imread(self.image_png)
+        noise = np.random.RandomState(0).normal(0, 15, image.shape)
+        noisy = np.clip(image + noise, 0, 255).astype(np.uint8)
+        assert utils.estimate_noise(image) < 5
+        assert 12 < utils.estimate_noise(noisy) < 18
+        assert utils.estimate_noise(np.zeros((2, 2), np.uint8)) == 0
+
+    def test_non_local_means(self):
+        image = cv2.imread(self.image_png)
+        denoised = utils.non_local_means(image, 10)
+        assert np.array_equal(
+            denoised, cv2.fastNlMeansDenoisingColored(image, None, 10, 10))
+        denoised_luma = utils.non_local_means(image, 10, luma=True)
+        assert not np.array_equal(denoised, denoised_luma)
+
+    def test_to_gray_uint8(self):
+        image = cv2.imread(self.image_png)
+        gray = utils.to_gray_uint8(image)
+        assert gray.ndim == 2
+        assert gray.dtype == np.uint8
+        assert utils.to_gray_uint8(gray) is gray
+        scaled = utils.to_gray_uint8(np.array([[0, 0.5], [1, 1]]))
+        assert np.array_equal(scaled, [[0, 128], [255, 255]])
+
+    def test_get_gray_histogram(self):
+        image = cv2.imread(self.image_png, 0)
+        histogram = utils.get_gray_histogram(image, band_size=1000)
+        assert histogram.shape == (256, )
+        assert np.array_equal(histogram,
+                              np.bincount(image.ravel(), minlength=256))
+
+    def test_histogram_thresholds(self):
+        image = cv2.imread(self.image_png, 0)
+        histogram = utils.get_gray_histogram(image)
+        thresholds = utils.histogram_thresholds(histogram)
+        assert thresholds['otsu'] == 96
+        assert thresholds['isodata'] == 95
+        assert 87 < thresholds['li'] < 88
+
+    def test_histogram_thresholds_single_value(self):
+        histogram = np.zeros(256, dtype=np.int64)
+        histogram[42] = 10
+        thresholds = utils.histogram_thresholds(histogram)
+        assert thresholds == {'isodata': 42, 'li': 42, 'otsu': 42}
+
+    def test_sauvola_binarize(self):
+        image = cv2.imread(self.image_png, 0)
+        binarized = utils.sauvola_binarize(image)
+        # bands of a few rows must give the same result as a single band
+        binarized_bands = utils.sauvola_binarize(image, band_size=1000)
+        assert np.array_equal(binarized, binarized_bands)
+        assert binarized.dtype == np.uint8
+        assert np.array_equal(np.unique(binarized), [0, 255])
+
+    def test_sauvola_binarize_scikit_image(self):
+        image = cv2.imread(self.image_png, 0)
+        threshold = threshold_sauvola(image, window_size=25, k=0.3)
+        assert np.array_equal(
+            utils.sauvola_binarize(image, window_size=25, k=0.3),
+            255 * (image <= threshold).astype(np.uint8)
+        )
+
+    def test_sauvola_binarize_even_window(self):
+        image = cv2.imread(self.image_png, 0)
+        with self.assertRaises(ValueError):
+            utils.sauvola_binarize(image, window_size=4)
+
     def test_parse_colors(self):
         colors = ['[0,1,2]', '[123,123,123]']
         obj = [(0, 1, 2), (123, 123, 123)]